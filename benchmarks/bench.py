@@ -0,0 +1,432 @@
+"""
+Benchmark FastAuth against local stand-ins for login.microsoftonline.com and graph.microsoft.com.
+
+    python -m benchmarks.bench --concurrency 32 --requests 2000 --output bench.json
+    python -m benchmarks.compare baseline.json bench.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from async_property import AwaitLoader, async_cached_property
+from fastapi import FastAPI, Request
+
+from fastauth.logs import configure_logging
+from fastauth.oauth_token_manager import (
+    MultiTenantTokenManager,
+    TokenStorage,
+    ManagedOAuthClient,
+    AccessToken,
+    GraphAPI,
+    make_user_key,
+    DEFAULT_SCOPES
+)
+from fastauth.oidc import IdTokenValidator, OpenIDMetadataCache
+from fastauth.server import AuthCallbackServer, AuthUrlBuilder, add_oauth, user_cache
+from benchmarks.stubs import STUB_TENANT_ID, StubConfig, StubGraph, StubIdentityProvider, StubServer, free_port
+
+SCOPES = DEFAULT_SCOPES
+BENCH_TENANT_CONCURRENCY = 1024
+
+
+class BenchAuthServer(AwaitLoader):
+    """AuthServer stand-in wired to the local stubs instead of Azure CLI"""
+
+    def __init__(self, idp_url: str, graph_url: str, redirect_uri: str, client_id: str = "bench-client"):
+        self.idp_url = idp_url
+        self.graph_url = graph_url
+        self.redirect_uri = redirect_uri
+        self.client_id = client_id
+        self._extra_clients: List[ManagedOAuthClient] = []
+
+    def __repr__(self):
+        return "[Bench.AuthServer]"
+
+    def new_oauth_client(self) -> ManagedOAuthClient:
+        """Client for the benchmark's own event loop; release it with close()"""
+        client = self._build_oauth_client()
+        self._extra_clients.append(client)
+        return client
+
+    async def close(self):
+        """Close clients handed out by new_oauth_client (the auth server closes its own on shutdown)"""
+        clients, self._extra_clients = self._extra_clients, []
+        for client in clients:
+            await client.close()
+
+    def _build_oauth_client(self) -> ManagedOAuthClient:
+        # Per client: the discovery cache's locks and the pooled sessions belong to the loop using them
+        metadata = OpenIDMetadataCache(self.idp_url)
+        # Every bench user lives in the stub's one tenant, so its per-tenant cap is the whole load
+        token_manager = MultiTenantTokenManager(self.client_id, self.redirect_uri, authority=self.idp_url,
+                                                metadata=metadata, max_concurrent_per_tenant=BENCH_TENANT_CONCURRENCY)
+        graph_api = GraphAPI()
+        graph_api.BASE_URL = f"{self.graph_url}/v1.0"
+        id_token_validator = IdTokenValidator(self.client_id, metadata)
+        return ManagedOAuthClient(token_manager, TokenStorage(), graph_api, id_token_validator)
+
+    @async_cached_property
+    async def oauth_client(self) -> ManagedOAuthClient:
+        return self._build_oauth_client()
+
+    @async_cached_property
+    async def auth_url_builder(self) -> AuthUrlBuilder:
+        oauth_client = await self.oauth_client
+        return AuthUrlBuilder(self.client_id, self.redirect_uri, authority=self.idp_url,
+                              metadata=oauth_client.token_manager.metadata)
+
+
+def build_app(oauth_url: str) -> FastAPI:
+    """Minimal downstream app protected by add_oauth"""
+    app = FastAPI()
+    add_oauth(app, oauth_url=oauth_url)
+
+    @app.get("/")
+    async def home(request: Request):
+        user = getattr(request.state, "user", None)
+        return {"user": user["id"] if user else None}
+
+    return app
+
+
+class Harness:
+    """Starts the Microsoft stubs, the auth server and a downstream app"""
+
+    def __init__(self, stub_config: StubConfig):
+        self.stub_config = stub_config
+        self.idp = StubIdentityProvider(stub_config)
+        self.graph = StubGraph(stub_config)
+        self._servers: List[StubServer] = []
+
+    def start(self) -> "Harness":
+        idp = self._serve(self.idp)
+        graph = self._serve(self.graph)
+
+        auth_port = free_port()
+        self.auth_server = BenchAuthServer(idp.url, graph.url, f"http://127.0.0.1:{auth_port}/callback")
+        self.auth_url = self._serve(AuthCallbackServer(self.auth_server), port=auth_port).url
+        self.app_url = self._serve(build_app(self.auth_url)).url
+        return self
+
+    def stop(self):
+        for server in reversed(self._servers):
+            server.stop()
+
+    def _serve(self, app, port: int = None) -> StubServer:
+        server = StubServer(app, port=port).start()
+        self._servers.append(server)
+        return server
+
+    def stub_stats(self) -> Dict[str, int]:
+        return {**{f"idp.{k}": v for k, v in self.idp.stats.items()},
+                **{f"graph.{k}": v for k, v in self.graph.stats.items()}}
+
+
+@dataclass
+class ScenarioResult:
+    """Latency distribution and throughput for one scenario"""
+    name: str
+    concurrency: int
+    requests: int
+    errors: int
+    duration_s: float
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    max_ms: float
+    stub_calls: Dict[str, int] = field(default_factory=dict)
+    background: Dict[str, int] = field(default_factory=dict)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+Operation = Callable[[int], Awaitable[bool]]
+
+
+@dataclass
+class BackgroundLoad:
+    """Unmeasured open-loop traffic (`rate` calls/s, however slow they get) kept running during a scenario
+
+    `stats` is filled in by the operation.
+    """
+    op: Operation
+    rate: float
+    stats: Counter = field(default_factory=Counter)
+
+
+async def run_scenario(name: str, op: Operation, concurrency: int, requests: int, harness: Harness,
+                       background: Optional[BackgroundLoad] = None) -> ScenarioResult:
+    """Run `requests` calls of `op` with `concurrency` workers and record per-call latency"""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+    stats_before = harness.stub_stats()
+    background_stats_before = Counter(background.stats) if background else Counter()
+    measuring = True
+
+    async def background_call(i: int):
+        try:
+            await background.op(i)
+        except Exception:
+            background.stats["exceptions"] += 1
+
+    async def background_driver():
+        in_flight = set()
+        started_at, fired = time.perf_counter(), 0
+        while measuring:
+            due = int((time.perf_counter() - started_at) * background.rate)
+            for i in range(fired, due):
+                task = asyncio.create_task(background_call(i))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            fired = max(fired, due)
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*in_flight)
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = await op(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    load = asyncio.create_task(background_driver()) if background else None
+    if load:
+        await asyncio.sleep(0.5)  # let the background load build up before measuring
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+    measuring = False
+    if load:
+        await load
+
+    stats_after = harness.stub_stats()
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    return ScenarioResult(
+        name=name,
+        concurrency=concurrency,
+        requests=len(latencies),
+        errors=errors,
+        duration_s=round(duration, 4),
+        rps=round(len(latencies) / duration, 2) if duration else 0.0,
+        p50_ms=round(percentile(ms, 50), 3),
+        p95_ms=round(percentile(ms, 95), 3),
+        p99_ms=round(percentile(ms, 99), 3),
+        mean_ms=round(sum(ms) / len(ms), 3) if ms else 0.0,
+        max_ms=round(ms[-1], 3) if ms else 0.0,
+        stub_calls={k: v - stats_before.get(k, 0) for k, v in stats_after.items() if v != stats_before.get(k, 0)},
+        background=dict(background.stats - background_stats_before) if background else {},
+    )
+
+
+def user_key_of(user: str) -> str:
+    """User key the stub identity provider's id_tokens resolve to"""
+    return make_user_key(f"id-{user}", STUB_TENANT_ID)
+
+
+def session_cookie(session: Optional[str]) -> Dict[str, str]:
+    return {"Cookie": f"session={session}"} if session else {}
+
+
+def new_client(concurrency: int) -> httpx.AsyncClient:
+    """HTTP client that never stores cookies, so every request carries exactly the session it is given"""
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    jar = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    return httpx.AsyncClient(limits=limits, timeout=30.0, cookies=jar)
+
+
+async def _login(client: httpx.AsyncClient, harness: Harness, user: str, session: str = None) -> bool:
+    """GET / for a state, then complete /callback the way Microsoft would redirect back"""
+    start = await client.get(f"{harness.auth_url}/", headers=session_cookie(session))
+    location = start.headers.get("location")
+    if start.status_code >= 400 or not location:
+        return False
+    state = parse_qs(urlparse(location).query)["state"][0]
+    session = session or start.cookies.get("session")  # the flow is tied to the session / handed out
+    callback = await client.get(f"{harness.auth_url}/callback", headers=session_cookie(session),
+                                params={"code": f"code.{user}.x", "state": state})
+    return callback.status_code < 400
+
+
+async def _signed_in_sessions(client: httpx.AsyncClient, harness: Harness, count: int) -> List[str]:
+    """Log `count` users in through the real flow so hit/miss scenarios have bound sessions"""
+    sessions = [f"bench-session-{i}" for i in range(count)]
+    for batch in range(0, count, 50):
+        await asyncio.gather(*(_login(client, harness, f"bench{i}", sessions[i])
+                               for i in range(batch, min(batch + 50, count))))
+    return sessions
+
+
+async def build_scenarios(harness: Harness, client: httpx.AsyncClient,
+                          storm_rate: float) -> Tuple[Dict[str, Operation], Dict[str, BackgroundLoad]]:
+    sessions = await _signed_in_sessions(client, harness, 500)
+
+    async def exchange_hit(i: int) -> bool:
+        response = await client.post(f"{harness.auth_url}/api/exchange",
+                                     json={"session_token": sessions[i % len(sessions)]})
+        return response.status_code == 200
+
+    async def exchange_miss(i: int) -> bool:
+        # Drop the cached user object so the exchange goes through token lookup + identity
+        n = i % len(sessions)
+        user_cache.expire_user(user_key_of(f"bench{n}"))
+        response = await client.post(f"{harness.auth_url}/api/exchange", json={"session_token": sessions[n]})
+        return response.status_code == 200
+
+    async def middleware(i: int) -> bool:
+        response = await client.get(f"{harness.app_url}/", headers=session_cookie(sessions[i % len(sessions)]))
+        return response.status_code == 200 and response.json()["user"] is not None
+
+    async def callback(i: int) -> bool:
+        return await _login(client, harness, f"user{i}", f"bench-callback-{i}")
+
+    # One shared client holding many users' tokens, like the auth server's
+    refresh_client = harness.auth_server.new_oauth_client()
+
+    async def refresh(i: int) -> bool:
+        user_key = make_user_key(f"refresh{i}")
+        expired = AccessToken(f"at.refresh{i}.old", "Bearer", 0, SCOPES, refresh_token=f"rt.refresh{i}.old")
+        await refresh_client.token_storage.store_token(user_key, expired)
+        token = await refresh_client.get_valid_token(user_key)
+        await refresh_client.token_storage.remove_token(user_key)
+        return token is not None
+
+    async def graph_data(i: int) -> bool:
+        # What /dashboard fetches beyond the profile, with the default projections
+        user_key = user_key_of(f"bench{i % len(sessions)}")
+        emails = await oauth_client.get_user_data("emails", user_key)
+        files = await oauth_client.get_user_data("files", user_key)
+        return "value" in emails and "value" in files
+
+    # Cold users whose cached object and access token have both lapsed: each exchange is a refresh + /me
+    oauth_client = await harness.auth_server.oauth_client
+    storm = BackgroundLoad(None, rate=storm_rate)
+
+    async def cold_exchange(i: int) -> bool:
+        user_key, session = make_user_key(f"storm{i}"), f"bench-storm-{i}"
+        user_cache.bind_session(session, user_key)
+        expired = AccessToken(f"at.storm{i}.old", "Bearer", 0, SCOPES, refresh_token=f"rt.storm{i}.old")
+        await oauth_client.token_storage.store_token(user_key, expired)
+        response = await client.post(f"{harness.auth_url}/api/exchange", json={"session_token": session})
+        storm.stats[f"status_{response.status_code}"] += 1
+        user_cache.remove_user(user_key)
+        await oauth_client.token_storage.remove_token(user_key)
+        return response.status_code in (200, 503)
+
+    storm.op = cold_exchange
+
+    scenarios = {
+        "exchange_hit": exchange_hit,
+        "exchange_miss": exchange_miss,
+        "middleware": middleware,
+        "callback": callback,
+        "refresh": refresh,
+        "exchange_hit_under_storm": exchange_hit,
+        "graph_data": graph_data,
+    }
+    return scenarios, {"exchange_hit_under_storm": storm}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args) -> dict:
+    stub_config = StubConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    harness = Harness(stub_config).start()
+
+    try:
+        async with new_client(args.concurrency) as client:
+            scenarios, backgrounds = await build_scenarios(harness, client, args.storm_rate)
+            selected = args.scenarios or list(scenarios)
+            results = []
+            for name in selected:
+                background = backgrounds.get(name)
+                if args.warmup:
+                    await run_scenario(name, scenarios[name], args.concurrency, args.warmup, harness, background)
+                result = await run_scenario(name, scenarios[name], args.concurrency, args.requests, harness,
+                                            background)
+                results.append(result)
+                print(f"{name:>14}: {result.rps:>9.1f} rps  p50={result.p50_ms:.2f}ms  "
+                      f"p95={result.p95_ms:.2f}ms  p99={result.p99_ms:.2f}ms  errors={result.errors}",
+                      file=sys.stderr)
+    finally:
+        await harness.auth_server.close()
+        harness.stop()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "storm_rate": args.storm_rate,
+            "stub": asdict(stub_config),
+        },
+        "scenarios": {result.name: asdict(result) for result in results},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="FastAuth benchmark suite")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests before each scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform stub latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub calls that fail")
+    parser.add_argument("--scenarios", nargs="*", help="Subset of scenarios to run")
+    parser.add_argument("--storm-rate", type=float, default=100.0,
+                        help="Cold exchanges per second fired during exchange_hit_under_storm")
+    parser.add_argument("--output", help="Write JSON results to this path (default: stdout)")
+    parser.add_argument("--log-level", default="WARNING", help="FastAuth log level while benchmarking")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging(args.log_level)
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
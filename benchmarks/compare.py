@@ -0,0 +1,59 @@
+"""
+Compare two benchmark result files and fail on regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def compare(baseline: dict, candidate: dict, threshold: float, min_delta_ms: float) -> list:
+    """Return (scenario, metric, old, new, change, regressed) rows for scenarios present in both runs"""
+    rows = []
+    for name, old in baseline["scenarios"].items():
+        new = candidate["scenarios"].get(name)
+        if not new:
+            continue
+
+        old_rps, new_rps = old["rps"], new["rps"]
+        change = (new_rps - old_rps) / old_rps if old_rps else 0.0
+        rows.append((name, "rps", old_rps, new_rps, change, change < -threshold))
+
+        for key in LATENCY_KEYS:
+            change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+            regressed = change > threshold and (new[key] - old[key]) > min_delta_ms
+            rows.append((name, key, old[key], new[key], change, regressed))
+
+        old_err = old["errors"] / old["requests"] if old["requests"] else 0.0
+        new_err = new["errors"] / new["requests"] if new["requests"] else 0.0
+        rows.append((name, "error_rate", old_err, new_err, new_err - old_err, new_err - old_err > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare FastAuth benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore latency changes smaller than this")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold, args.min_delta_ms)
+    print(f"baseline  {baseline['meta']['commit'][:12]}  vs  candidate  {candidate['meta']['commit'][:12]}")
+    for name, metric, old, new, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:>14} {metric:>10}: {old:>10.3f} -> {new:>10.3f}  ({change:+.1%}) {flag}")
+
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
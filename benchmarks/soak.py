@@ -0,0 +1,227 @@
+"""
+Memory soak test: hammer AuthCallbackServer with logins, abandoned flows, cookieless requests
+and logouts against the local Microsoft stand-ins, sampling RSS and store sizes as it goes.
+
+    python -m benchmarks.soak --duration 3600 --max-rss-growth-mb 64 --max-store-size 100000
+
+Exits non-zero when RSS growth or any store size exceeds its bound.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+
+import httpx
+
+from fastauth import server
+from fastauth.logs import configure_logging
+from fastauth.server import user_cache
+from benchmarks.bench import Harness, _login, new_client, session_cookie, user_key_of
+from benchmarks.stubs import StubConfig
+
+# Relative weights of each simulated client behaviour
+DEFAULT_MIX = {
+    "login": 4,
+    "abandoned": 2,
+    "cookieless": 2,
+    "exchange": 6,
+    "logout": 2,
+}
+
+
+def rss_bytes() -> int:
+    """Current resident set size; falls back to peak RSS where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def store_sizes(harness: Harness) -> Dict[str, int]:
+    """Sizes of every in-memory store that grows with traffic"""
+    oauth_client = await harness.auth_server.oauth_client
+    token_keys = [key for shard in oauth_client.token_storage._shards for key in shard]
+    return {
+        "users": len(user_cache._users),
+        "sessions": len(user_cache._sessions),
+        "pkce_challenges": len(oauth_client.token_manager._pkce_challenges),
+        "tokens": len(oauth_client.token_storage),
+        # Tokens go when their user's last session ends; only logins in flight should hold any here
+        "tokens_without_session": sum(key not in user_cache._user_sessions for key in token_keys),
+    }
+
+
+@dataclass
+class Sample:
+    elapsed_s: float
+    operations: int
+    errors: int
+    rss_mb: float
+    stores: Dict[str, int]
+
+
+class Soak:
+    """Drives a weighted mix of client behaviours and samples memory over time"""
+
+    def __init__(self, harness: Harness, client: httpx.AsyncClient, mix: Dict[str, int]):
+        self.harness = harness
+        self.client = client
+        self.operations = 0
+        self.errors = 0
+        self._names = list(mix)
+        self._weights = [mix[name] for name in self._names]
+        self._signed_in: List[tuple] = []
+
+    async def login(self, i: int) -> bool:
+        user, session = f"soak{i}", f"soak-session-{i}"
+        ok = await _login(self.client, self.harness, user, session)
+        if ok:
+            self._signed_in.append((session, user_key_of(user)))
+        return ok
+
+    async def abandoned(self, i: int) -> bool:
+        """Start a flow and never come back from Microsoft"""
+        response = await self.client.get(f"{self.harness.auth_url}/")
+        return response.status_code < 400
+
+    async def cookieless(self, i: int) -> bool:
+        """Every request without a cookie mints a brand-new session"""
+        response = await self.client.get(f"{self.harness.app_url}/")
+        return response.status_code < 400
+
+    async def exchange(self, i: int) -> bool:
+        session = random.choice(self._signed_in)[0] if self._signed_in else f"soak-anon-{i}"
+        response = await self.client.post(f"{self.harness.auth_url}/api/exchange", json={"session_token": session})
+        return response.status_code in (200, 302)
+
+    async def logout(self, i: int) -> bool:
+        if not self._signed_in:
+            return True
+        session, user_key = self._signed_in.pop(random.randrange(len(self._signed_in)))
+        if random.random() < 0.5:
+            response = await self.client.get(f"{self.harness.auth_url}/logout", headers=session_cookie(session))
+        else:
+            response = await self.client.delete(f"{self.harness.auth_url}/api/user/{user_key}")
+        return response.status_code == 200
+
+    async def worker(self, deadline: float, limit: int):
+        while time.monotonic() < deadline and (not limit or self.operations < limit):
+            i = self.operations
+            self.operations += 1
+            name = random.choices(self._names, self._weights)[0]
+            try:
+                ok = await getattr(self, name)(i)
+            except Exception:
+                ok = False
+            if not ok:
+                self.errors += 1
+
+
+async def run(args) -> dict:
+    # Sessions must expire within the run, or token eviction is never exercised
+    user_cache.session_ttl = args.session_ttl
+    server.PURGE_INTERVAL_SECONDS = min(server.PURGE_INTERVAL_SECONDS, args.session_ttl)
+    harness = Harness(StubConfig(latency=args.latency, error_rate=args.error_rate)).start()
+    samples: List[Sample] = []
+    failures: List[str] = []
+
+    try:
+        async with new_client(args.concurrency) as client:
+            soak = Soak(harness, client, DEFAULT_MIX)
+            started = time.monotonic()
+            deadline = started + args.duration
+            workers = [asyncio.create_task(soak.worker(deadline, args.operations)) for _ in range(args.concurrency)]
+
+            baseline_rss = None
+            while not all(w.done() for w in workers):
+                await asyncio.sleep(args.sample_interval)
+                gc.collect()
+                sample = Sample(
+                    elapsed_s=round(time.monotonic() - started, 2),
+                    operations=soak.operations,
+                    errors=soak.errors,
+                    rss_mb=round(rss_bytes() / 2 ** 20, 2),
+                    stores=await store_sizes(harness),
+                )
+                samples.append(sample)
+                print(f"[{sample.elapsed_s:>8.1f}s] ops={sample.operations} errors={sample.errors} "
+                      f"rss={sample.rss_mb}MB stores={sample.stores}", file=sys.stderr)
+
+                if baseline_rss is None and sample.elapsed_s >= args.warmup:
+                    baseline_rss = sample.rss_mb
+                exceeded = check_bounds(sample, baseline_rss, args)
+                if exceeded:
+                    failures = exceeded
+                    if args.fail_fast:
+                        break
+
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        harness.stop()
+
+    return {
+        "config": vars(args),
+        "passed": not failures,
+        "failures": failures,
+        "samples": [asdict(s) for s in samples],
+    }
+
+
+def check_bounds(sample: Sample, baseline_rss, args) -> List[str]:
+    """Describe every configured bound the sample exceeds"""
+    failures = []
+    if baseline_rss is not None and sample.rss_mb - baseline_rss > args.max_rss_growth_mb:
+        failures.append(f"RSS grew {sample.rss_mb - baseline_rss:.1f}MB (> {args.max_rss_growth_mb}MB)")
+    for store, size in sample.stores.items():
+        if size > args.max_store_size:
+            failures.append(f"{store} holds {size} entries (> {args.max_store_size})")
+    orphaned = sample.stores.get("tokens_without_session", 0)
+    if orphaned > args.max_orphaned_tokens:
+        failures.append(f"{orphaned} users hold tokens without a session (> {args.max_orphaned_tokens})")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="FastAuth memory soak test")
+    parser.add_argument("--duration", type=float, default=300.0, help="Seconds to run")
+    parser.add_argument("--operations", type=int, default=0, help="Stop after this many operations (0 = no limit)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sample-interval", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=10.0, help="Seconds before the RSS baseline is taken")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64.0)
+    parser.add_argument("--max-store-size", type=int, default=100_000)
+    parser.add_argument("--max-orphaned-tokens", type=int, default=64,
+                        help="Users allowed to hold tokens without a live session (logins in flight)")
+    parser.add_argument("--session-ttl", type=float, default=60.0, help="Session lifetime in seconds")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop at the first exceeded bound")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub calls that fail")
+    parser.add_argument("--output", help="Write JSON samples to this path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging("WARNING")
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for failure in report["failures"]:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import secrets
+import socket
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qs, urlencode
+
+import jwt
+import uvicorn
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+
+
+@dataclass
+class StubConfig:
+    """Latency and error injection for the local Microsoft stand-ins"""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    token_lifetime: int = 3600
+
+    async def delay(self):
+        """Sleep for the configured latency (+ uniform jitter)"""
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def injected_error(self) -> Optional[JSONResponse]:
+        """Return an error response for the configured fraction of requests"""
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse(
+                {"error": "stub_injected_error", "error_description": "Injected by StubConfig"},
+                status_code=self.error_status,
+                headers={"Retry-After": "1"}
+            )
+        return None
+
+
+def _user_from_token(value: str) -> str:
+    """Stub tokens look like '<kind>.<user>.<nonce>'"""
+    parts = value.split(".")
+    return parts[1] if len(parts) >= 2 else "anonymous"
+
+
+STUB_TENANT_ID = "00000000-0000-0000-0000-00000000f00d"
+
+
+class SigningKeys:
+    """RSA keys for stub id_tokens; rotate() publishes a new current key next to the previous one"""
+
+    def __init__(self):
+        self._keys = []
+        self.rotate()
+
+    def rotate(self):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._keys = [(secrets.token_hex(8), private_key)] + self._keys[:1]
+
+    def sign(self, claims: dict) -> str:
+        kid, private_key = self._keys[0]
+        return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+
+    def jwks(self) -> dict:
+        keys = []
+        for kid, private_key in self._keys:
+            jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+            keys.append({**jwk, "kid": kid, "use": "sig"})
+        return {"keys": keys}
+
+
+class StubIdentityProvider(FastAPI):
+    """Stand-in for login.microsoftonline.com (authorize, token, discovery and JWKS endpoints)"""
+
+    def __init__(self, config: StubConfig = None):
+        super().__init__()
+        self.config = config or StubConfig()
+        self.stats = Counter()
+        self.signing_keys = SigningKeys()
+
+        def tenant_id(tenant: str) -> str:
+            return STUB_TENANT_ID if tenant in ("common", "organizations", "consumers") else tenant
+
+        @self.get("/{tenant}/v2.0/.well-known/openid-configuration")
+        async def discovery(tenant: str, request: Request):
+            self.stats["discovery"] += 1
+            base = str(request.base_url).rstrip("/")
+            issuer_tenant = "{tenantid}" if tenant_id(tenant) != tenant else tenant
+            return {
+                "issuer": f"{base}/{issuer_tenant}/v2.0",
+                "authorization_endpoint": f"{base}/{tenant}/oauth2/v2.0/authorize",
+                "token_endpoint": f"{base}/{tenant}/oauth2/v2.0/token",
+                "jwks_uri": f"{base}/{tenant}/discovery/v2.0/keys",
+                "id_token_signing_alg_values_supported": ["RS256"],
+            }
+
+        @self.get("/{tenant}/discovery/v2.0/keys")
+        async def keys(tenant: str):
+            self.stats["jwks"] += 1
+            return self.signing_keys.jwks()
+
+        @self.get("/{tenant}/oauth2/v2.0/authorize")
+        async def authorize(tenant: str, request: Request):
+            """Skip the sign-in UI and hand back a code for a synthetic user"""
+            self.stats["authorize"] += 1
+            params = request.query_params
+            user = params.get("login_hint") or f"user{secrets.randbelow(10 ** 9)}"
+            query = urlencode({"code": f"code.{user}.{secrets.token_hex(4)}", "state": params.get("state", "")})
+            return RedirectResponse(f"{params['redirect_uri']}?{query}")
+
+        @self.post("/{tenant}/oauth2/v2.0/token")
+        async def token(tenant: str, request: Request):
+            """Issue stub tokens for authorization_code and refresh_token grants"""
+            self.stats["token"] += 1
+            await self.config.delay()
+            error = self.config.injected_error()
+            if error:
+                self.stats["token_errors"] += 1
+                return error
+
+            form = {k: v[0] for k, v in parse_qs((await request.body()).decode()).items()}
+            grant_type = form.get("grant_type")
+            if grant_type == "authorization_code":
+                user = _user_from_token(form.get("code", ""))
+            elif grant_type == "refresh_token":
+                self.stats["refresh"] += 1
+                user = _user_from_token(form.get("refresh_token", ""))
+            else:
+                return JSONResponse({"error": "unsupported_grant_type"}, status_code=400)
+
+            scope = form.get("scope", "")
+            response = {
+                "token_type": "Bearer",
+                "expires_in": self.config.token_lifetime,
+                "scope": " ".join(s for s in scope.split() if s not in ("openid", "profile", "email", "offline_access")),
+                "access_token": f"at.{user}.{secrets.token_hex(8)}",
+                "refresh_token": f"rt.{user}.{secrets.token_hex(8)}",
+            }
+            if "openid" in scope.split():
+                now = int(time.time())
+                tid = tenant_id(tenant)
+                response["id_token"] = self.signing_keys.sign({
+                    "iss": f"{str(request.base_url).rstrip('/')}/{tid}/v2.0",
+                    "aud": form.get("client_id"),
+                    "iat": now,
+                    "nbf": now,
+                    "exp": now + self.config.token_lifetime,
+                    "sub": f"sub-{user}",
+                    "oid": f"id-{user}",
+                    "tid": tid,
+                    "name": user.title(),
+                    "preferred_username": f"{user}@contoso.test",
+                    "email": f"{user}@contoso.test",
+                })
+            return response
+
+
+class StubGraph(FastAPI):
+    """Stand-in for graph.microsoft.com/v1.0"""
+
+    def __init__(self, config: StubConfig = None):
+        super().__init__()
+        self.config = config or StubConfig()
+        self.stats = Counter()
+
+        async def _guard(request: Request, name: str) -> Optional[JSONResponse]:
+            self.stats[name] += 1
+            await self.config.delay()
+            error = self.config.injected_error()
+            if error:
+                self.stats[f"{name}_errors"] += 1
+            return error
+
+        def _respond(request: Request, name: str, payload: dict) -> JSONResponse:
+            """Apply $select/$top the way Graph does and count the bytes sent"""
+            select = request.query_params.get("$select")
+            top = request.query_params.get("$top")
+            items = payload.get("value")
+            if items is not None and top:
+                items = items[:int(top)]
+            if select:
+                fields = set(select.split(",")) | {"id"}
+                project = lambda item: {k: v for k, v in item.items() if k in fields}
+                payload = {"value": [project(i) for i in items]} if items is not None else project(payload)
+            elif items is not None:
+                payload = {"value": items}
+            response = JSONResponse(payload)
+            self.stats[f"{name}_bytes"] += len(response.body)
+            return response
+
+        @self.get("/v1.0/me")
+        async def me(request: Request):
+            error = await _guard(request, "me")
+            if error:
+                return error
+            user = _user_from_token(request.headers.get("Authorization", "").removeprefix("Bearer "))
+            return _respond(request, "me", {
+                "id": f"id-{user}",
+                "displayName": user.title(),
+                "mail": f"{user}@contoso.test",
+                "userPrincipalName": f"{user}@contoso.test",
+                "businessPhones": ["+1 425 555 0100"],
+                "givenName": user.title(),
+                "surname": "Test",
+                "jobTitle": "Engineer",
+                "mobilePhone": None,
+                "officeLocation": "18/2111",
+                "preferredLanguage": "en-US",
+            })
+
+        @self.get("/v1.0/me/messages")
+        async def messages(request: Request):
+            error = await _guard(request, "messages")
+            return error or _respond(request, "messages", {"value": [_message(i) for i in range(MAILBOX_PAGE)]})
+
+        @self.get("/v1.0/me/drive/root/children")
+        async def files(request: Request):
+            error = await _guard(request, "files")
+            return error or _respond(request, "files", {"value": [_drive_item(i) for i in range(MAILBOX_PAGE)]})
+
+
+# Graph's default page size when no $top is given
+MAILBOX_PAGE = 10
+_BODY = "<html><body>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 80 + "</body></html>"
+
+
+def _message(i: int) -> dict:
+    """Message shaped like Graph's default (unprojected) payload"""
+    address = {"emailAddress": {"name": f"Sender {i}", "address": f"sender{i}@contoso.test"}}
+    return {
+        "id": str(i),
+        "createdDateTime": "2024-01-01T00:00:00Z",
+        "lastModifiedDateTime": "2024-01-01T00:00:00Z",
+        "changeKey": "CQAAABYAAAA" * 4,
+        "categories": [],
+        "receivedDateTime": f"2024-01-01T00:{i:02d}:00Z",
+        "sentDateTime": f"2024-01-01T00:{i:02d}:00Z",
+        "hasAttachments": False,
+        "internetMessageId": f"<{i}@contoso.test>",
+        "subject": f"Message {i}",
+        "bodyPreview": _BODY[12:267],
+        "importance": "normal",
+        "parentFolderId": "AAMkAGI2" * 16,
+        "conversationId": "AAQkAGI2" * 8,
+        "isRead": bool(i % 2),
+        "webLink": f"https://outlook.office365.com/owa/?ItemID={i}",
+        "body": {"contentType": "html", "content": _BODY},
+        "sender": address,
+        "from": address,
+        "toRecipients": [address],
+        "ccRecipients": [],
+        "bccRecipients": [],
+        "replyTo": [],
+        "flag": {"flagStatus": "notFlagged"},
+    }
+
+
+def _drive_item(i: int) -> dict:
+    """Drive item shaped like Graph's default (unprojected) payload"""
+    identity = {"user": {"id": "id-owner", "displayName": "Owner"}}
+    return {
+        "id": str(i),
+        "name": f"file{i}.txt",
+        "size": 1024 * i,
+        "createdDateTime": "2024-01-01T00:00:00Z",
+        "lastModifiedDateTime": "2024-01-01T00:00:00Z",
+        "eTag": f"\"{{{i:08d}-0000-0000-0000-000000000000}},1\"",
+        "cTag": f"\"c:{{{i:08d}-0000-0000-0000-000000000000}},1\"",
+        "webUrl": f"https://contoso-my.sharepoint.com/personal/file{i}.txt",
+        "createdBy": identity,
+        "lastModifiedBy": identity,
+        "parentReference": {"driveId": "b!" + "x" * 64, "driveType": "business", "id": "root", "path": "/drive/root:"},
+        "file": {"mimeType": "text/plain", "hashes": {"quickXorHash": "A" * 28}},
+        "fileSystemInfo": {"createdDateTime": "2024-01-01T00:00:00Z", "lastModifiedDateTime": "2024-01-01T00:00:00Z"},
+        "shared": {"scope": "users"},
+    }
+
+
+def free_port() -> int:
+    """Ask the OS for an unused localhost port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubServer:
+    """Runs an ASGI app with uvicorn in a background thread"""
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = None):
+        self.app = app
+        self.host = host
+        self.port = port or free_port()
+        self._server = uvicorn.Server(uvicorn.Config(
+            app, host=self.host, port=self.port, log_level="warning", access_log=False
+        ))
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 10.0) -> "StubServer":
+        """Start in a daemon thread and wait until uvicorn is accepting connections"""
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{self.url} did not start within {timeout}s")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        if self._thread:
+            self._thread.join(timeout=5)
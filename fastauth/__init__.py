@@ -0,0 +1,17 @@
+# Exports resolve lazily so `from fastauth import add_oauth` doesn't drag in the server stack
+_EXPORTS = {
+    "add_oauth": "fastauth.middleware",
+    "AuthServer": "fastauth.core",
+    "AppManifest": "fastauth.manifest",
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    return getattr(importlib.import_module(module), name)
+
+
+__all__ = list(_EXPORTS)
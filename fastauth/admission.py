@@ -0,0 +1,95 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict
+
+
+class Overloaded(RuntimeError):
+    """Raised when a request is shed instead of queued"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} is overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    queued: int = 0
+    shed_queue_full: int = 0
+    shed_timeout: int = 0
+    skipped_busy: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+@dataclass
+class AdmissionController:
+    """Caps concurrent work on an expensive path, with a bounded wait queue; anything beyond is shed fast"""
+    name: str = "admission"
+    max_concurrent: int = 64
+    max_queue: int = 256
+    queue_timeout: float = 2.0
+    retry_after: int = 1
+    stats: AdmissionStats = field(default_factory=AdmissionStats)
+
+    def __post_init__(self):
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._active = 0
+        self._waiting = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a slot for the duration of the block; raises Overloaded if none frees up in time"""
+        if self._slots.locked():
+            if self._waiting >= self.max_queue:
+                self.stats.shed_queue_full += 1
+                raise Overloaded(self.name, self.retry_after)
+
+            self._waiting += 1
+            self.stats.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats.shed_timeout += 1
+                raise Overloaded(self.name, self.retry_after)
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        async with self._held():
+            yield
+
+    @asynccontextmanager
+    async def try_admit(self):
+        """Hold a slot only if one is free right now (never queues); raises Overloaded otherwise
+
+        For optional background work, which must not take queue places from requests.
+        """
+        if self._slots.locked():
+            self.stats.skipped_busy += 1
+            raise Overloaded(self.name, self.retry_after)
+        await self._slots.acquire()  # free slot and nobody queued: returns without yielding
+
+        async with self._held():
+            yield
+
+    @asynccontextmanager
+    async def _held(self):
+        self._active += 1
+        self.stats.admitted += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._slots.release()
@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import mimetypes
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip-only without it
+    brotli = None
+
+STATIC_DIR = Path(__file__).parent / "static"
+
+
+@dataclass
+class StaticAsset:
+    """One static file, hashed and precompressed once at startup"""
+    name: str
+    digest: str
+    media_type: str
+    body: bytes
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+    @property
+    def hashed_name(self) -> str:
+        stem, dot, suffix = self.name.rpartition(".")
+        return f"{stem}.{self.digest}.{suffix}" if dot else f"{self.name}.{self.digest}"
+
+    @classmethod
+    def load(cls, name: str, path: Path) -> "StaticAsset":
+        body = path.read_bytes()
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "image/svg+xml"):
+            media_type += "; charset=utf-8"
+
+        # Only keep compressed variants that actually save bytes
+        gz = gzip.compress(body, compresslevel=9, mtime=0)
+        br = brotli.compress(body, quality=11) if brotli else None
+        return cls(
+            name=name,
+            digest=hashlib.sha256(body).hexdigest()[:12],
+            media_type=media_type,
+            body=body,
+            gzip=gz if len(gz) < len(body) else None,
+            br=br if br and len(br) < len(body) else None,
+        )
+
+
+class StaticAssets:
+    """Serves package static files under content-hashed URLs with long-lived caching and precompressed variants"""
+
+    IMMUTABLE = "public, max-age=31536000, immutable"
+    REVALIDATE = "public, no-cache"
+
+    def __init__(self, directory: Path = STATIC_DIR, prefix: str = "/static"):
+        self.directory = directory
+        self.prefix = prefix.rstrip("/")
+        self._by_name: Dict[str, StaticAsset] = {}
+        self._by_hashed_name: Dict[str, StaticAsset] = {}
+
+        for path in sorted(directory.rglob("*")) if directory.is_dir() else ():
+            if path.is_file():
+                asset = StaticAsset.load(path.relative_to(directory).as_posix(), path)
+                self._by_name[asset.name] = asset
+                self._by_hashed_name[asset.hashed_name] = asset
+
+    def url(self, name: str) -> str:
+        """Content-hashed URL for a static file (used as `static_url` in templates)"""
+        return f"{self.prefix}/{self._by_name[name].hashed_name}"
+
+    def mount(self, app):
+        """Register the static route on a FastAPI app"""
+        app.add_api_route(f"{self.prefix}/{{path:path}}", self.serve, methods=["GET", "HEAD"], include_in_schema=False)
+
+    async def serve(self, path: str, request: Request) -> Response:
+        asset = self._by_hashed_name.get(path)
+        # Hashed URLs never change content; plain names are still served but must revalidate
+        cache_control = self.IMMUTABLE if asset else self.REVALIDATE
+        asset = asset or self._by_name.get(path)
+        if not asset:
+            return Response(status_code=404)
+
+        body, encoding = self._negotiate(asset, request.headers.get("accept-encoding", ""))
+        etag = f'"{asset.digest}-{encoding}"' if encoding else f'"{asset.digest}"'
+        headers = {"Cache-Control": cache_control, "ETag": etag, "Vary": "Accept-Encoding"}
+
+        if self._not_modified(asset, request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=200, headers=headers, media_type=asset.media_type)
+        return Response(body, headers=headers, media_type=asset.media_type)
+
+    @staticmethod
+    def _negotiate(asset: StaticAsset, accept_encoding: str):
+        """Pick the smallest variant the client accepts: br, then gzip, then identity"""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, _, params = part.strip().partition(";")
+            if coding and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(coding.lower())
+
+        if asset.br and ("br" in accepted or "*" in accepted):
+            return asset.br, "br"
+        if asset.gzip and ("gzip" in accepted or "*" in accepted):
+            return asset.gzip, "gzip"
+        return asset.body, None
+
+    @staticmethod
+    def _not_modified(asset: StaticAsset, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Any variant of the same content is a match (weak comparison per RFC 9110)
+        tags = (tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(","))
+        return any(tag.split("-", 1)[0] == asset.digest for tag in tags)
@@ -1,21 +1,27 @@
 import asyncio
+import os
 import time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
 from async_property import AwaitLoader, async_cached_property
-from loguru import logger as log
-from pyzurecli import AzureCLI, AzureCLIAppRegistration
 
+from fastauth.logs import ensure_logging, log
+from fastauth.manifest import AppManifest
+from fastauth.oidc import OpenIDMetadataCache, IdTokenValidator
 from fastauth.server import AuthCallbackServer, ServerManager, AuthUrlBuilder, user_cache
-from oauth_token_manager import (
+from fastauth.oauth_token_manager import (
     MultiTenantTokenManager,
     TokenStorage,
     ManagedOAuthClient,
     AccessToken,
-    GraphAPI
+    GraphAPI,
+    GraphQuery
 )
 
+if TYPE_CHECKING:
+    from pyzurecli import AzureCLI, AzureCLIAppRegistration
+
 
 class AuthServer(AwaitLoader):
     """Multi-tenant OAuth authentication server"""
@@ -23,61 +29,114 @@ class AuthServer(AwaitLoader):
     _instance = None
     _oauth_client = None
 
-    def __init__(self, path: Path):
+    # Cached properties built from the manifest, dropped when it is refreshed
+    _MANIFEST_DERIVED = ("client_id", "admin_consent_url", "oauth_client", "auth_url_builder")
+
+    def __init__(self, path: Path, manifest: Optional[AppManifest] = None):
         self.path = path
+        self._explicit_manifest = manifest
 
     def __repr__(self):
         return f"[{self.path.name.title()}.AuthServer]"
 
     @classmethod
-    async def __async_init__(cls, path: Path):
+    async def __async_init__(cls, path: Path, manifest: Optional[AppManifest] = None):
         if not cls._instance:
-            cls._instance = cls(path)
+            cls._instance = cls(path, manifest)
         return cls._instance
 
     @async_cached_property
-    async def azure_cli(self) -> AzureCLI:
+    async def manifest(self) -> AppManifest:
+        """Explicit config, then FASTAUTH_* env vars, then the cached manifest; Azure CLI only as a last resort"""
+        manifest = self._explicit_manifest or AppManifest.from_env() or AppManifest.load(self.path)
+        if manifest:
+            return manifest
+
+        log.debug(f"[{self}]: No cached manifest, provisioning through Azure CLI...")
+        return await AppManifest.provision(self.path)
+
+    async def refresh_manifest(self) -> AppManifest:
+        """Re-resolve the app registration through Azure CLI, rewrite the cached manifest and rebuild its dependents
+
+        Sign-ins started before the refresh have to be restarted; stored tokens survive if the client id is unchanged.
+        """
+        current = await self.manifest
+        manifest = await AppManifest.provision(
+            self.path, redirect_uri=current.redirect_uri, tenant=current.tenant, authority=current.authority
+        )
+        self.manifest = manifest
+
+        old_client, AuthServer._oauth_client = AuthServer._oauth_client, None
+        for name in self._MANIFEST_DERIVED:
+            try:
+                delattr(self, name)
+            except KeyError:
+                pass  # never loaded
+
+        if old_client:
+            if manifest.client_id == current.client_id:
+                oauth_client = await self.oauth_client
+                oauth_client.token_storage = old_client.token_storage
+            await old_client.close()
+        return manifest
+
+    @async_cached_property
+    async def azure_cli(self) -> "AzureCLI":
+        from pyzurecli import AzureCLI
         return await AzureCLI.__async_init__(self.path)
 
     @async_cached_property
-    async def app_registration(self) -> AzureCLIAppRegistration:
+    async def app_registration(self) -> "AzureCLIAppRegistration":
         azure_cli = await self.azure_cli
         return await azure_cli.app_registration
 
     @async_cached_property
     async def client_id(self) -> str:
-        app_registration = await self.app_registration
-        return await app_registration.client_id
+        manifest = await self.manifest
+        return manifest.client_id
+
+    @async_cached_property
+    async def admin_consent_url(self) -> str:
+        manifest = await self.manifest
+        return manifest.admin_consent_url
 
     @async_cached_property
     async def oauth_client(self) -> ManagedOAuthClient:
         """Create multi-tenant OAuth client - shared instance"""
         if not AuthServer._oauth_client:
-            client_id = await self.client_id
-            azure_cli = await self.azure_cli
+            manifest = await self.manifest
 
-            token_manager = MultiTenantTokenManager(client_id)
+            # One discovery cache for token routing and id_token validation
+            metadata = OpenIDMetadataCache(manifest.authority)
+            token_manager = MultiTenantTokenManager(
+                manifest.client_id, manifest.redirect_uri, manifest.authority, manifest.tenant, metadata
+            )
             token_storage = TokenStorage()
             graph_api = GraphAPI()
+            id_token_validator = IdTokenValidator(manifest.client_id, metadata, manifest.tenant)
 
-            AuthServer._oauth_client = ManagedOAuthClient(token_manager, token_storage, graph_api)
+            AuthServer._oauth_client = ManagedOAuthClient(token_manager, token_storage, graph_api, id_token_validator)
             log.debug(f"[{self}]: ✅ Created OAuth client instance")
 
         return AuthServer._oauth_client
 
     @async_cached_property
     async def auth_url_builder(self) -> AuthUrlBuilder:
-        client_id = await self.client_id
-        return AuthUrlBuilder(client_id)
+        manifest = await self.manifest
+        oauth_client = await self.oauth_client
+        return AuthUrlBuilder(manifest.client_id, manifest.redirect_uri, manifest.authority, manifest.tenant,
+                              oauth_client.token_manager.metadata)
 
     @async_cached_property
     async def server_manager(self) -> ServerManager:
-        """Create server manager"""
-        callback_app = AuthCallbackServer(self)
+        """Create server manager; user cache snapshots are opt-in via FASTAUTH_SNAPSHOT_PATH"""
+        snapshot_path = os.environ.get("FASTAUTH_SNAPSHOT_PATH")
+        callback_app = AuthCallbackServer(self, snapshot_path=Path(snapshot_path) if snapshot_path else None)
         return ServerManager(callback_app)
 
     async def start(self):
         """Start the multi-tenant authentication server"""
+        ensure_logging()
         server_manager = await self.server_manager
         client_id = await self.client_id
 
@@ -94,20 +153,20 @@ class AuthServer(AwaitLoader):
         server_manager = await self.server_manager
         server_manager.stop()
 
-    async def get_current_token(self) -> Optional[AccessToken]:
-        """Get current valid access token"""
+    async def get_current_token(self, user_key: str) -> Optional[AccessToken]:
+        """Get a user's valid access token"""
         oauth_client = await self.oauth_client
-        return await oauth_client.get_valid_token()
+        return await oauth_client.get_valid_token(user_key)
 
-    async def get_user_data_via_cli(self, data_type: str = "profile"):
-        """Get user data via Azure CLI Graph API"""
+    async def get_user_data_via_cli(self, data_type: str = "profile", *, user_key: str,
+                                    query: Optional[GraphQuery] = None):
+        """Get a user's data via Graph API (data_type stays first, as in ManagedOAuthClient.get_user_data)"""
         oauth_client = await self.oauth_client
-        return await oauth_client.get_user_data(data_type)
+        return await oauth_client.get_user_data(data_type, user_key, query=query)
 
     async def generate_admin_consent_url(self) -> str:
-        """Generate admin consent URL for cross-tenant permissions"""
-        app_registration = await self.app_registration
-        return await app_registration.generate_admin_consent_url()
+        """Admin consent URL for cross-tenant permissions (precomputed in the manifest)"""
+        return await self.admin_consent_url
 
     # Legacy compatibility
     async def launch_as_thread(self):
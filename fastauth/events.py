@@ -0,0 +1,134 @@
+import asyncio
+import json
+import secrets
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Deque, List, Optional, Set
+
+from fastauth.logs import log
+
+# Event types published by UserCache
+STORE = "store"      # first time a user is cached
+REFRESH = "refresh"  # cached user object replaced with fresh data
+EXPIRE = "expire"    # cached user object dropped (TTL or forced); sessions still bound
+REMOVE = "remove"    # user signed out (logout, or last session expired): cached object, sessions and tokens gone
+RESET = "reset"      # feed-level: the consumer fell too far behind and must drop everything it holds
+
+_CLOSED = object()  # queued to a subscriber that was cut off
+
+
+@dataclass
+class ChangeEvent:
+    seq: int
+    type: str
+    user_id: str
+    tenant_id: Optional[str] = None
+    ts: float = 0.0
+    epoch: str = ""
+
+    @property
+    def id(self) -> str:
+        """SSE event id: sequence numbers are only meaningful within the epoch (process) that issued them"""
+        return f"{self.epoch}-{self.seq}"
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(asdict(self))}\n\n"
+
+
+class ChangeFeed:
+    """Sequenced ring buffer of user cache changes with push delivery to subscribers"""
+
+    def __init__(self, capacity: int = 10_000, subscriber_buffer: int = 1_000, epoch: Optional[str] = None):
+        self.capacity = capacity
+        self.subscriber_buffer = subscriber_buffer
+        # Sequence numbers restart with every process; the epoch tells a resuming client it missed a restart
+        self.epoch = epoch or secrets.token_hex(4)
+        self._events: Deque[ChangeEvent] = deque(maxlen=capacity)
+        self._seq = 0
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    @property
+    def last_event_id(self) -> str:
+        return f"{self.epoch}-{self._seq}"
+
+    def publish(self, type: str, user_id: str, tenant_id: Optional[str] = None) -> ChangeEvent:
+        """Record a change and push it to every subscriber; subscribers that can't keep up are cut off"""
+        self._seq += 1
+        event = ChangeEvent(self._seq, type, user_id, tenant_id, time.time(), self.epoch)
+        self._events.append(event)
+
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The consumer reconnects with Last-Event-ID and catches up from the buffer
+                log.debug("events.subscriber_dropped seq={seq}", seq=event.seq)
+                self._subscribers.discard(queue)
+                self._close(queue)
+        return event
+
+    def since(self, event_id: str) -> Optional[List[ChangeEvent]]:
+        """Events after an event id, or None if the stream can't be resumed from it
+
+        That is the case for ids from another epoch (before a restart) or malformed ones, and when
+        some of the events after it already fell out of the buffer.
+        """
+        epoch, _, seq = event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq == self._seq:
+            return []
+        if seq > self._seq:
+            return None
+        if not self._events or self._events[0].seq > seq + 1:
+            return None
+        start = seq + 1 - self._events[0].seq
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    async def subscribe(self, since: Optional[str] = None,
+                        idle_timeout: Optional[float] = None) -> AsyncIterator[Optional[ChangeEvent]]:
+        """Replay events after the event id `since` (if given), then stream live ones until cut off
+
+        With an idle_timeout, None is yielded whenever nothing happened for that long (for heartbeats).
+        """
+        queue: asyncio.Queue = asyncio.Queue(self.subscriber_buffer)
+        # Register before replaying so nothing published in between is lost
+        self._subscribers.add(queue)
+        try:
+            last = self._seq
+            if since is not None:
+                backlog = self.since(since)
+                if backlog is None:
+                    yield ChangeEvent(self._seq, RESET, "", ts=time.time(), epoch=self.epoch)
+                else:
+                    for event in backlog:
+                        yield event
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), idle_timeout)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is _CLOSED:
+                    return
+                if event.seq > last:
+                    yield event
+        finally:
+            self._subscribers.discard(queue)
+
+    @staticmethod
+    def _close(queue: asyncio.Queue):
+        # Discard what the subscriber hasn't read and leave only the end-of-stream marker
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(_CLOSED)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
@@ -0,0 +1,74 @@
+"""
+FastAuth logging: free when a level is off, structured when it is on.
+
+Hot paths log through `log` with brace placeholders and keyword fields instead of f-strings, so
+nothing is formatted unless a handler accepts the level, and every field lands in `record["extra"]`
+for structured sinks. Per-request events go through `sampled()` so a busy server logs one in N.
+
+    log.debug("exchange.hit user={user}", user=user_id)
+    if sampled("exchange.hit", 100):
+        ...
+"""
+import itertools
+import os
+import sys
+from typing import Dict, Iterator, Optional
+
+from loguru import logger
+
+log = logger.bind(component="fastauth")
+
+DEFAULT_SAMPLE_EVERY = int(os.environ.get("FASTAUTH_LOG_SAMPLE_EVERY", "100"))
+
+_counters: Dict[str, Iterator[int]] = {}
+
+
+def sampled(event: str, every: int = DEFAULT_SAMPLE_EVERY) -> bool:
+    """True for the first and then every Nth occurrence of an event (every <= 1 keeps all of them)"""
+    if every <= 1:
+        return True
+    counter = _counters.get(event)
+    if counter is None:
+        counter = _counters[event] = itertools.count()
+    return next(counter) % every == 0
+
+
+_handler_id: Optional[int] = None
+
+
+def is_fastauth(record) -> bool:
+    return record["extra"].get("component") == "fastauth"
+
+
+def configure_logging(level: str = None, sink=sys.stderr, serialize: bool = None, enqueue: bool = True) -> int:
+    """
+    Send FastAuth's records to one non-blocking sink, replacing the one installed by an earlier call.
+
+    enqueue=True hands records to a background thread, so the event loop never waits on log I/O.
+    Defaults come from FASTAUTH_LOG_LEVEL (INFO) and FASTAUTH_LOG_JSON. Handlers added by the
+    application are left alone; only loguru's untouched default stderr handler is swapped for an
+    equivalent that skips FastAuth records, so they are not also written synchronously at DEBUG.
+    """
+    global _handler_id
+    level = level or os.environ.get("FASTAUTH_LOG_LEVEL", "INFO")
+    if serialize is None:
+        serialize = os.environ.get("FASTAUTH_LOG_JSON", "").lower() in ("1", "true", "yes")
+
+    if _handler_id is None:
+        try:
+            logger.remove(0)  # loguru's default handler; ValueError once the application replaced it
+        except ValueError:
+            pass
+        else:
+            logger.add(sys.stderr, filter=lambda record: not is_fastauth(record))
+    else:
+        logger.remove(_handler_id)
+    _handler_id = logger.add(sink, level=level, filter=is_fastauth, serialize=serialize, enqueue=enqueue,
+                             backtrace=False, diagnose=False)
+    return _handler_id
+
+
+def ensure_logging():
+    """Install the default FastAuth sink unless configure_logging() already ran"""
+    if _handler_id is None:
+        configure_logging()
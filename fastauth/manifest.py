@@ -0,0 +1,104 @@
+import json
+import os
+from dataclasses import dataclass, asdict, fields
+from pathlib import Path
+from typing import ClassVar, Optional
+from urllib.parse import urlencode
+
+from fastauth.logs import log
+
+
+@dataclass
+class AppManifest:
+    """App registration details needed at boot, cached on disk so startup never shells out to Azure CLI"""
+    client_id: str
+    redirect_uri: str = "http://localhost:8080/callback"
+    tenant: str = "common"
+    authority: str = "https://login.microsoftonline.com"
+    admin_consent_url: str = ""
+
+    FILENAME: ClassVar[str] = "fastauth.manifest.json"
+
+    def __post_init__(self):
+        self.authority = self.authority.rstrip("/")
+        if not self.admin_consent_url:
+            query = urlencode({"client_id": self.client_id, "redirect_uri": self.redirect_uri})
+            self.admin_consent_url = f"{self.authority}/{self.tenant}/adminconsent?{query}"
+
+    @property
+    def authorize_endpoint(self) -> str:
+        return f"{self.authority}/{self.tenant}/oauth2/v2.0/authorize"
+
+    @property
+    def token_endpoint(self) -> str:
+        return f"{self.authority}/{self.tenant}/oauth2/v2.0/token"
+
+    @classmethod
+    def path_for(cls, path: Path) -> Path:
+        """Manifest location for a project directory (or an explicit .json path)"""
+        return path if path.suffix == ".json" else path / cls.FILENAME
+
+    @classmethod
+    def from_env(cls) -> Optional["AppManifest"]:
+        """Explicit config via FASTAUTH_CLIENT_ID (+ optional FASTAUTH_REDIRECT_URI/TENANT/AUTHORITY)"""
+        client_id = os.environ.get("FASTAUTH_CLIENT_ID")
+        if not client_id:
+            return None
+
+        overrides = {
+            "redirect_uri": os.environ.get("FASTAUTH_REDIRECT_URI"),
+            "tenant": os.environ.get("FASTAUTH_TENANT"),
+            "authority": os.environ.get("FASTAUTH_AUTHORITY"),
+        }
+        return cls(client_id, **{k: v for k, v in overrides.items() if v})
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["AppManifest"]:
+        """Read a cached manifest, or None if there isn't a usable one"""
+        file = cls.path_for(path)
+        try:
+            data = json.loads(file.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning(f"[AppManifest]: Ignoring unreadable manifest {file}: {e}")
+            return None
+
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def save(self, path: Path) -> Path:
+        """Atomically write the manifest"""
+        file = self.path_for(path)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(asdict(self), indent=2))
+        os.replace(tmp, file)
+        return file
+
+    @classmethod
+    async def provision(cls, path: Path, redirect_uri: str = "http://localhost:8080/callback", tenant: str = "common",
+                        authority: str = "https://login.microsoftonline.com") -> "AppManifest":
+        """Resolve the app registration through Azure CLI and cache it next to the project"""
+        from pyzurecli import AzureCLI
+
+        azure_cli = await AzureCLI.__async_init__(path.parent if path.suffix == ".json" else path)
+        app_registration = await azure_cli.app_registration
+        manifest = cls(
+            client_id=await app_registration.client_id,
+            redirect_uri=redirect_uri,
+            tenant=tenant,
+            authority=authority,
+            admin_consent_url=await app_registration.generate_admin_consent_url(),
+        )
+        file = manifest.save(path)
+        log.debug(f"[AppManifest]: 💾 Cached app registration to {file}")
+        return manifest
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else Path.cwd()
+    print(asyncio.run(AppManifest.provision(target)))
@@ -0,0 +1,78 @@
+"""
+Client-side OAuth middleware.
+
+Kept free of server-side imports (uvicorn, Jinja2, pydantic models, the token manager) so
+apps that only need `add_oauth` pay for nothing else; httpx is imported on the first request.
+"""
+import secrets
+
+from starlette.responses import RedirectResponse, PlainTextResponse
+
+from fastauth.logs import log, sampled
+
+SESSION_MAX_AGE = 3600 * 8
+
+
+def add_oauth(app, oauth_url="http://localhost:8080"):
+    """Dead simple OAuth with automatic session management"""
+    client = None
+
+    def get_client():
+        nonlocal client
+        if client is None:
+            import httpx
+            client = httpx.AsyncClient()
+        return client
+
+    @app.middleware("http")
+    async def oauth_middleware(request, call_next):
+        # Get or create session
+        session = request.cookies.get("session")
+        if not session:
+            session = secrets.token_urlsafe(32)
+            if sampled("middleware.new_session"):
+                log.debug("middleware.new_session path={path}", path=request.url.path)
+
+        # Skip static files
+        if request.url.path.startswith("/static"):
+            return await call_next(request)
+
+        # Try to get user from OAuth service
+        try:
+            response = await get_client().post(f"{oauth_url}/api/exchange", json={"session_token": session})
+            status = response.status_code
+        except Exception as e:
+            status = None
+            if sampled("middleware.exchange_failed"):
+                log.warning("middleware.exchange_failed error={error}", error=type(e).__name__)
+
+        if status == 200:
+            # Got user - set session cookie and continue
+            request.state.user = response.json()
+            response_obj = await call_next(request)
+            if not request.cookies.get("session"):
+                response_obj.set_cookie("session", session, max_age=SESSION_MAX_AGE)
+            return response_obj
+
+        elif status == 302:
+            # Need OAuth - redirect with return URL and session
+            return_url = str(request.url)
+            redirect_response = RedirectResponse(f"{oauth_url}/?return_url={return_url}")
+            redirect_response.set_cookie("session", session, max_age=SESSION_MAX_AGE)
+            return redirect_response
+
+        elif status == 503:
+            # Auth server is shedding load - tell the browser to come back instead of serving anonymously
+            busy_response = PlainTextResponse("Sign-in is busy, retry shortly", status_code=503,
+                                              headers={"Retry-After": response.headers.get("Retry-After", "1")})
+            if not request.cookies.get("session"):
+                busy_response.set_cookie("session", session, max_age=SESSION_MAX_AGE)
+            return busy_response
+
+        # Continue without user
+        if sampled("middleware.anonymous"):
+            log.info("middleware.anonymous path={path}", path=request.url.path)
+        response_obj = await call_next(request)
+        if not request.cookies.get("session"):
+            response_obj.set_cookie("session", session, max_age=SESSION_MAX_AGE)
+        return response_obj
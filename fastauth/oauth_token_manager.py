@@ -1,14 +1,52 @@
+import asyncio
 import base64
 import hashlib
 import secrets
 import ssl
 import time
-from dataclasses import dataclass
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from dataclasses import dataclass, fields, replace
+from functools import cached_property
+from typing import Optional, Dict, Any, List, FrozenSet, Iterable, Tuple, Union
+from weakref import WeakValueDictionary
 
 import aiohttp
 import certifi
-from loguru import logger as log
+from fastauth.admission import AdmissionController, Overloaded
+from fastauth.logs import log
+from fastauth.oidc import IdTokenValidator, OpenIDMetadataCache, identity_from_claims
+
+GRAPH_RESOURCE = "https://graph.microsoft.com"
+# Sign-in scopes: never part of an access token's granted scopes
+OIDC_SCOPES = frozenset({"openid", "profile", "email", "offline_access"})
+DEFAULT_SCOPES = "openid profile email User.Read Mail.Read Files.Read offline_access"
+# Authority segments that accept users from many tenants (anything else pins the app to one tenant)
+MULTI_TENANT_AUTHORITIES = frozenset({"common", "organizations", "consumers"})
+
+
+def parse_scopes(scopes: Union[str, Iterable[str]]) -> FrozenSet[str]:
+    """Normalized scope set: case-folded, with the implicit Graph resource prefix removed"""
+    if isinstance(scopes, str):
+        scopes = scopes.split()
+    graph_prefix = f"{GRAPH_RESOURCE}/"
+    return frozenset(
+        scope[len(graph_prefix):] if scope.startswith(graph_prefix) else scope
+        for scope in (s.casefold() for s in scopes)
+    )
+
+
+def scope_resource(scope: str) -> str:
+    """Resource a (normalized) scope belongs to: 'api://app/Read' -> 'api://app', bare names -> Graph"""
+    resource, sep, _ = scope.rpartition("/")
+    return resource if sep and resource else GRAPH_RESOURCE
+
+
+def resource_of(scopes: FrozenSet[str]) -> str:
+    """The single resource a set of scopes targets (Microsoft issues one token per resource)"""
+    resources = {scope_resource(s) for s in scopes - OIDC_SCOPES}
+    if len(resources) > 1:
+        raise ValueError(f"Scopes span several resources: {sorted(resources)}")
+    return resources.pop() if resources else GRAPH_RESOURCE
 
 
 @dataclass
@@ -21,6 +59,7 @@ class AccessToken:
     refresh_token: Optional[str] = None
     id_token: Optional[str] = None
     issued_at: float = None
+    claims: Optional[Dict[str, Any]] = None  # validated id_token claims, carried across refreshes
 
     def __post_init__(self):
         if self.issued_at is None:
@@ -38,6 +77,48 @@ class AccessToken:
     def authorization_header(self) -> str:
         return f"{self.token_type} {self.access_token}"
 
+    @cached_property
+    def scopes(self) -> FrozenSet[str]:
+        return parse_scopes(self.scope) - OIDC_SCOPES
+
+    @cached_property
+    def resource(self) -> str:
+        return resource_of(self.scopes)
+
+    def has_scope(self, scope: str) -> bool:
+        return parse_scopes(scope) <= self.scopes
+
+    def covers(self, requested: FrozenSet[str]) -> bool:
+        """Whether this token grants every requested (normalized) scope"""
+        return requested - OIDC_SCOPES <= self.scopes
+
+
+def make_user_key(user_id: str, tenant_id: Optional[str] = None) -> str:
+    """Token storage key for a user in their home tenant"""
+    return f"{tenant_id or 'common'}:{user_id}"
+
+
+def tenant_of(user_key: str) -> Optional[str]:
+    """Home tenant a user key was made with, if it has one"""
+    tenant, sep, _ = user_key.partition(":")
+    return tenant if sep and tenant != "common" else None
+
+
+def user_key_for(identity: Dict[str, Any]) -> str:
+    """User key from an identity (id_token claims or Graph profile)"""
+    user_id = identity.get("id") or identity.get("userPrincipalName") or identity.get("mail")
+    if not user_id:
+        raise ValueError("Identity has no user id")
+    return make_user_key(user_id, identity.get("tenantId"))
+
+
+@dataclass
+class AuthenticatedUser:
+    """Result of a completed login"""
+    user_key: str
+    token: AccessToken
+    identity: Dict[str, Any]
+
 
 @dataclass
 class PKCEChallenge:
@@ -45,6 +126,8 @@ class PKCEChallenge:
     code_verifier: str
     code_challenge: str
     code_challenge_method: str = "S256"
+    tenant: str = "common"  # authority the flow was started against; the code must be redeemed there too
+    session: Optional[str] = None  # session_key() of the browser that started the flow; only it may finish it
 
     @classmethod
     def generate(cls) -> "PKCEChallenge":
@@ -59,19 +142,51 @@ class PKCEChallenge:
         )
 
 
+@dataclass
+class TenantPool:
+    """Pooled connections and a concurrency cap for one tenant's token endpoint"""
+    session: aiohttp.ClientSession
+    limit: AdmissionController
+    active: int = 0  # calls using the pool; only idle pools are evicted
+
+
 # noinspection PyUnusedLocal
 class MultiTenantTokenManager:
-    """Manages OAuth tokens for multi-tenant scenarios"""
+    """Manages OAuth tokens for multi-tenant scenarios, routing token calls to each user's home tenant"""
 
-    def __init__(self, client_id: str, redirect_uri: str = "http://localhost:8080/callback"):
+    FALLBACK_TTL = 300  # how long a tenant whose discovery failed uses the well-known endpoint layout
+    # Token calls run inside the caller's admission slot, so a slow tenant must fail quickly, not hold it
+    REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=3)
+    # Tenant names come from users (/?tenant=, id_token tid), so per-tenant state is LRU-bounded
+    MAX_TENANT_POOLS = 256
+
+    def __init__(self, client_id: str, redirect_uri: str = "http://localhost:8080/callback",
+                 authority: str = "https://login.microsoftonline.com", tenant: str = "common",
+                 metadata: Optional[OpenIDMetadataCache] = None, max_concurrent_per_tenant: int = 16):
         self.client_id = client_id
         self.redirect_uri = redirect_uri
-        self.token_endpoint = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
+        self.authority = authority.rstrip('/')
+        self.tenant = tenant
+        self.token_endpoint = self._well_known_token_endpoint(tenant)
+        self.metadata = metadata or OpenIDMetadataCache(self.authority)
+        self.max_concurrent_per_tenant = max_concurrent_per_tenant
         self._pkce_challenges: Dict[str, PKCEChallenge] = {}
-
-    def create_pkce_challenge(self, state: str) -> PKCEChallenge:
+        # Per discovered tenant: pooled connections and a concurrency cap, so one slow tenant can't starve the
+        # rest. Tenants without working discovery share a single pool instead of getting one each.
+        self._pools: "OrderedDict[str, TenantPool]" = OrderedDict()
+        self._shared_pool: Optional[TenantPool] = None
+        self._fallbacks: "OrderedDict[str, float]" = OrderedDict()
+
+    def route_tenant(self, tenant: Optional[str] = None) -> str:
+        """Authority segment to use for a tenant: only multi-tenant apps route per tenant"""
+        return tenant if tenant and self.tenant in MULTI_TENANT_AUTHORITIES else self.tenant
+
+    def create_pkce_challenge(self, state: str, tenant: Optional[str] = None,
+                              session: Optional[str] = None) -> PKCEChallenge:
         """Create and store PKCE challenge"""
         challenge = PKCEChallenge.generate()
+        challenge.tenant = self.route_tenant(tenant)
+        challenge.session = session
         self._pkce_challenges[state] = challenge
         return challenge
 
@@ -79,8 +194,14 @@ class MultiTenantTokenManager:
         """Get and remove PKCE challenge (one-time use)"""
         return self._pkce_challenges.pop(state, None)
 
-    async def exchange_code_for_token(self, auth_code: str, scopes: str, pkce_verifier: str) -> AccessToken:
-        """Exchange authorization code for access token"""
+    async def token_endpoint_for(self, tenant: str) -> str:
+        """Token endpoint from the tenant's cached discovery document"""
+        endpoint, _ = await self._resolve_token_endpoint(tenant)
+        return endpoint
+
+    async def exchange_code_for_token(self, auth_code: str, scopes: str, pkce_verifier: str,
+                                      tenant: Optional[str] = None) -> AccessToken:
+        """Exchange authorization code for access token (at the tenant the flow started with)"""
         data = {
             'client_id': self.client_id,
             'scope': scopes,
@@ -90,29 +211,18 @@ class MultiTenantTokenManager:
             'code_verifier': pkce_verifier
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    self.token_endpoint,
-                    data=data,
-                    headers={'Content-Type': 'application/x-www-form-urlencoded'}
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    log.error(f"Token exchange failed: {response.status} - {error_text}")
-                    raise RuntimeError(f"Token exchange failed: {response.status}")
-
-                token_data = await response.json()
-                return AccessToken(
-                    access_token=token_data['access_token'],
-                    token_type=token_data.get('token_type', 'Bearer'),
-                    expires_in=token_data['expires_in'],
-                    scope=token_data.get('scope', scopes),
-                    refresh_token=token_data.get('refresh_token'),
-                    id_token=token_data.get('id_token')
-                )
+        token_data = await self._post_token(self.route_tenant(tenant), data, "exchange")
+        return AccessToken(
+            access_token=token_data['access_token'],
+            token_type=token_data.get('token_type', 'Bearer'),
+            expires_in=token_data['expires_in'],
+            scope=token_data.get('scope', scopes),
+            refresh_token=token_data.get('refresh_token'),
+            id_token=token_data.get('id_token')
+        )
 
-    async def refresh_token(self, refresh_token: str, scopes: str) -> AccessToken:
-        """Refresh access token"""
+    async def refresh_token(self, refresh_token: str, scopes: str, tenant: Optional[str] = None) -> AccessToken:
+        """Refresh access token at the user's home tenant"""
         data = {
             'client_id': self.client_id,
             'scope': scopes,
@@ -120,45 +230,211 @@ class MultiTenantTokenManager:
             'grant_type': 'refresh_token'
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    self.token_endpoint,
-                    data=data,
-                    headers={'Content-Type': 'application/x-www-form-urlencoded'}
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    log.error(f"Token refresh failed: {response.status}")
-                    raise RuntimeError(f"Token refresh failed: {response.status}")
-
-                token_data = await response.json()
-                return AccessToken(
-                    access_token=token_data['access_token'],
-                    token_type=token_data.get('token_type', 'Bearer'),
-                    expires_in=token_data['expires_in'],
-                    scope=token_data.get('scope', scopes),
-                    refresh_token=token_data.get('refresh_token', refresh_token),
-                    id_token=token_data.get('id_token')
-                )
+        token_data = await self._post_token(self.route_tenant(tenant), data, "refresh")
+        return AccessToken(
+            access_token=token_data['access_token'],
+            token_type=token_data.get('token_type', 'Bearer'),
+            expires_in=token_data['expires_in'],
+            scope=token_data.get('scope', scopes),
+            refresh_token=token_data.get('refresh_token', refresh_token),
+            id_token=token_data.get('id_token')
+        )
+
+    async def close(self):
+        """Close every tenant's pooled session"""
+        pools = list(self._pools.values()) + ([self._shared_pool] if self._shared_pool else [])
+        self._pools, self._shared_pool = OrderedDict(), None
+        for pool in pools:
+            await pool.session.close()
+
+    async def _resolve_token_endpoint(self, tenant: str) -> Tuple[str, bool]:
+        """(token endpoint, whether it came from the tenant's discovery document)"""
+        until = self._fallbacks.get(tenant)
+        if until is not None:
+            if until > time.monotonic():
+                return self._well_known_token_endpoint(tenant), False
+            del self._fallbacks[tenant]
+        try:
+            metadata = await self.metadata.get_metadata(tenant)
+            return metadata["token_endpoint"], True
+        except Exception as e:
+            log.warning("token.discovery_failed tenant={tenant} error={error}", tenant=tenant, error=e)
+            self._fallbacks[tenant] = time.monotonic() + self.FALLBACK_TTL
+            while len(self._fallbacks) > self.MAX_TENANT_POOLS:
+                self._fallbacks.popitem(last=False)
+            return self._well_known_token_endpoint(tenant), False
+
+    async def _post_token(self, tenant: str, data: dict, grant: str) -> dict:
+        endpoint, discovered = await self._resolve_token_endpoint(tenant)
+        pool = await self._checkout_pool(tenant if discovered else None)
+        try:
+            # A saturated tenant is shed at once (Overloaded) instead of queueing while its callers hold slots
+            async with pool.limit.admit():
+                async with pool.session.post(
+                        endpoint,
+                        data=data,
+                        headers={'Content-Type': 'application/x-www-form-urlencoded'}
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        log.error("token.{grant}_failed tenant={tenant} status={status} body={body}",
+                                  grant=grant, tenant=tenant, status=response.status, body=error_text)
+                        raise RuntimeError(f"Token {grant} failed: {response.status}")
+                    return await response.json()
+        finally:
+            pool.active -= 1
+
+    async def _checkout_pool(self, tenant: Optional[str]) -> TenantPool:
+        """The tenant's pool (or the shared one for tenant=None), marked active so it isn't evicted in use"""
+        evicted = []
+        if tenant is None:
+            if self._shared_pool is None or self._shared_pool.session.closed:
+                self._shared_pool = self._new_pool("shared")
+            pool = self._shared_pool
+        else:
+            pool = self._pools.get(tenant)
+            if pool is None or pool.session.closed:
+                pool = self._pools[tenant] = self._new_pool(tenant)
+                evicted = self._evict_idle_pools()
+            self._pools.move_to_end(tenant)
+        pool.active += 1
+
+        for old in evicted:
+            await old.session.close()
+        return pool
+
+    def _evict_idle_pools(self) -> List[TenantPool]:
+        """Drop least recently used idle pools beyond MAX_TENANT_POOLS; busy ones stay until a later eviction"""
+        excess = len(self._pools) - self.MAX_TENANT_POOLS
+        if excess <= 0:
+            return []
+        evicted = []
+        for tenant, pool in list(self._pools.items())[:-1]:
+            if len(evicted) >= excess:
+                break
+            if not pool.active:
+                evicted.append(self._pools.pop(tenant))
+        return evicted
+
+    def _new_pool(self, tenant: str) -> TenantPool:
+        connector = aiohttp.TCPConnector(limit=self.max_concurrent_per_tenant, keepalive_timeout=30)
+        return TenantPool(aiohttp.ClientSession(connector=connector, timeout=self.REQUEST_TIMEOUT),
+                          AdmissionController(f"token endpoint ({tenant})", self.max_concurrent_per_tenant, max_queue=0))
+
+    def _well_known_token_endpoint(self, tenant: str) -> str:
+        return f"{self.authority}/{tenant}/oauth2/v2.0/token"
 
 
 class TokenStorage:
-    """In-memory token storage"""
+    """In-memory token cache keyed by (user key, resource), sharded by user key with per-key locks"""
+
+    def __init__(self, shards: int = 64):
+        self._shards: List[Dict[str, Dict[str, List[AccessToken]]]] = [{} for _ in range(shards)]
+        # Locks only live while someone holds or waits on them
+        self._locks: List[WeakValueDictionary] = [WeakValueDictionary() for _ in range(shards)]
+
+    def _shard(self, key: str) -> int:
+        return hash(key) % len(self._shards)
 
-    def __init__(self):
-        self._tokens: Dict[str, AccessToken] = {}
+    def lock(self, key: str) -> asyncio.Lock:
+        """Lock for one user key; different keys never share a lock"""
+        locks = self._locks[self._shard(key)]
+        lock = locks.get(key)
+        if lock is None:
+            lock = locks[key] = asyncio.Lock()
+        return lock
 
     async def store_token(self, key: str, token: AccessToken):
-        self._tokens[key] = token
-        log.info(f"Stored token for: {key}")
+        """Add a token, dropping any token for the same resource whose scopes it covers"""
+        resources = self._shards[self._shard(key)].setdefault(key, {})
+        tokens = resources.get(token.resource, [])
+        resources[token.resource] = [t for t in tokens if not token.covers(t.scopes)] + [token]
+        log.debug("token.stored user={user} resource={resource}", user=key, resource=token.resource)
+
+    async def get_token(self, key: str, scopes: Optional[FrozenSet[str]] = None) -> Optional[AccessToken]:
+        """Newest token covering `scopes` (default: any Graph token), preferring unexpired ones"""
+        scopes = scopes if scopes is not None else frozenset()
+        tokens = self._shards[self._shard(key)].get(key, {}).get(resource_of(scopes), ())
+        covering = [t for t in tokens if t.covers(scopes)]
+        if not covering:
+            return None
+        return max(covering, key=lambda t: (not t.is_expired, t.issued_at))
+
+    async def get_tokens(self, key: str) -> List[AccessToken]:
+        return [t for tokens in self._shards[self._shard(key)].get(key, {}).values() for t in tokens]
 
-    async def get_token(self, key: str) -> Optional[AccessToken]:
-        return self._tokens.get(key)
+    async def get_refresh_token(self, key: str) -> Optional[str]:
+        """Latest refresh token for a user; Microsoft refresh tokens work across resources"""
+        tokens = [t for t in await self.get_tokens(key) if t.refresh_token]
+        return max(tokens, key=lambda t: t.issued_at).refresh_token if tokens else None
 
     async def remove_token(self, key: str):
-        if key in self._tokens:
-            del self._tokens[key]
-            log.info(f"Removed token for: {key}")
+        """Remove every token held for a user"""
+        if self._shards[self._shard(key)].pop(key, None) is not None:
+            log.debug("token.removed user={user}", user=key)
+
+    def __len__(self) -> int:
+        return sum(len(tokens) for shard in self._shards for resources in shard.values() for tokens in resources.values())
+
+
+@dataclass(frozen=True)
+class GraphQuery:
+    """OData query options for a Graph call ($select, $filter, $expand, $orderby, $top)
+
+    When layered over a default with merged(), options named in `clear` drop the default instead of replacing it.
+    """
+    select: Tuple[str, ...] = ()
+    filter: Optional[str] = None
+    expand: Tuple[str, ...] = ()
+    orderby: Tuple[str, ...] = ()
+    top: Optional[int] = None
+    clear: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        unknown = set(self.clear) - {"select", "filter", "expand", "orderby", "top"}
+        if unknown:
+            raise ValueError(f"Unknown query options to clear: {sorted(unknown)}")
+
+    def params(self) -> Dict[str, str]:
+        """Query-string parameters; unset options are left out"""
+        params = {}
+        if self.select:
+            params["$select"] = ",".join(self.select)
+        if self.filter:
+            params["$filter"] = self.filter
+        if self.expand:
+            params["$expand"] = ",".join(self.expand)
+        if self.orderby:
+            params["$orderby"] = ",".join(self.orderby)
+        if self.top is not None:
+            params["$top"] = str(self.top)
+        return params
+
+    def merged(self, overrides: Optional["GraphQuery"]) -> "GraphQuery":
+        """This query with every option that `overrides` sets replaced and every option it clears removed"""
+        if overrides is None:
+            return self
+        changes = {f.name: getattr(overrides, f.name) for f in fields(overrides)
+                   if f.name != "clear" and getattr(overrides, f.name) not in (None, ())}
+        changes.update({name: GraphQuery.__dataclass_fields__[name].default for name in overrides.clear})
+        # Graph rejects a default $orderby next to a $filter that doesn't lead with the same property
+        # (InefficientFilter), so a caller's filter only keeps the ordering it asks for itself
+        if overrides.filter and not overrides.orderby:
+            changes["orderby"] = ()
+        return replace(self, **changes)
+
+
+# Only what FastAuth and its templates use; full payloads (message bodies, every drive item facet) are large
+DEFAULT_PROJECTIONS: Dict[str, GraphQuery] = {
+    "profile": GraphQuery(select=("id", "displayName", "mail", "userPrincipalName", "jobTitle",
+                                  "officeLocation", "preferredLanguage")),
+    "emails": GraphQuery(select=("id", "subject", "from", "receivedDateTime", "isRead", "bodyPreview", "webLink"),
+                         orderby=("receivedDateTime desc",), top=10),
+    "files": GraphQuery(select=("id", "name", "size", "lastModifiedDateTime", "webUrl", "file", "folder"), top=10),
+}
+
+# Graph's own default profile payload, for callers that want everything rather than the projection
+FULL_PROFILE = GraphQuery(clear=("select",))
 
 
 class GraphAPI:
@@ -166,16 +442,27 @@ class GraphAPI:
 
     BASE_URL = "https://graph.microsoft.com/v1.0"
 
-    def __init__(self):
+    def __init__(self, projections: Optional[Dict[str, Optional[GraphQuery]]] = None):
         # build a context using certifi CA bundle
         self.ssl_ctx = ssl.create_default_context(cafile=certifi.where())
+        # Per data type default query; map a type to None to fetch Graph's full default payload
+        self.projections = {**DEFAULT_PROJECTIONS, **(projections or {})}
+
+    def query_for(self, data_type: str, query: Optional[GraphQuery] = None) -> Optional[GraphQuery]:
+        """Default projection for a data type with the caller's options layered on top"""
+        projection = self.projections.get(data_type)
+        return projection.merged(query) if projection else query
 
-    async def call(self, token: str, endpoint: str, method: str = "GET", data=None, params=None) -> dict:
+    async def call(self, token: str, endpoint: str, method: str = "GET", data=None, params=None,
+                   query: Optional[GraphQuery] = None) -> dict:
         url = f"{self.BASE_URL}{endpoint}"
         headers = {
             "Authorization": f"Bearer {token}",
-            "Accept": "application/json"
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate"
         }
+        if query:
+            params = {**query.params(), **(params or {})}
         async with aiohttp.ClientSession() as session:
             async with session.request(
                     method, url, headers=headers, json=data, params=params, ssl=self.ssl_ctx
@@ -186,79 +473,125 @@ class GraphAPI:
                     text = await resp.text()
                     return {"error": str(e), "body": text}
 
-    async def get_user_profile(self, token: str) -> dict:
-        return await self.call(token, "/me")
+    async def get_user_profile(self, token: str, query: Optional[GraphQuery] = None) -> dict:
+        return await self.call(token, "/me", query=self.query_for("profile", query))
 
-    async def get_user_emails(self, token: str, count: int = 10) -> dict:
-        return await self.call(token, "/me/messages", params={"$top": count})
+    async def get_user_emails(self, token: str, count: Optional[int] = None,
+                              query: Optional[GraphQuery] = None) -> dict:
+        query = self.query_for("emails", query)
+        if count is not None:
+            query = (query or GraphQuery()).merged(GraphQuery(top=count))
+        return await self.call(token, "/me/messages", query=query)
 
-    async def get_user_files(self, token: str, count: int = 10) -> dict:
-        return await self.call(token, "/me/drive/root/children", params={"$top": count})
+    async def get_user_files(self, token: str, count: Optional[int] = None,
+                             query: Optional[GraphQuery] = None) -> dict:
+        query = self.query_for("files", query)
+        if count is not None:
+            query = (query or GraphQuery()).merged(GraphQuery(top=count))
+        return await self.call(token, "/me/drive/root/children", query=query)
 
 
 class ManagedOAuthClient:
     """High-level OAuth client with automatic token management"""
 
-    def __init__(self, token_manager: MultiTenantTokenManager, token_storage: TokenStorage, graph_api: GraphAPI):
+    def __init__(self, token_manager: MultiTenantTokenManager, token_storage: TokenStorage, graph_api: GraphAPI,
+                 id_token_validator: Optional[IdTokenValidator] = None):
         self.token_manager = token_manager
         self.token_storage = token_storage
         self.graph_api = graph_api
-        self._current_token: Optional[AccessToken] = None
-
-    async def authenticate_with_code(self, auth_code: str, scopes: str, pkce_verifier: str) -> AccessToken:
-        """Complete OAuth flow"""
-        token = await self.token_manager.exchange_code_for_token(auth_code, scopes, pkce_verifier)
-
-        await self.token_storage.store_token("current", token)
-        self._current_token = token
+        self.id_token_validator = id_token_validator
+
+    async def authenticate_with_code(self, auth_code: str, scopes: str, pkce_verifier: str,
+                                     tenant: Optional[str] = None) -> AuthenticatedUser:
+        """Complete OAuth flow and store the token under the signed-in user's key"""
+        token = await self.token_manager.exchange_code_for_token(auth_code, scopes, pkce_verifier, tenant)
+        identity = await self.get_identity(token)
+        user_key = user_key_for(identity)
+
+        await self.token_storage.store_token(user_key, token)
+
+        log.info("auth.success user={user} expires_in={expires_in}", user=user_key, expires_in=token.expires_in)
+        return AuthenticatedUser(user_key, token, identity)
+
+    async def get_valid_token(self, user_key: str, scopes: str = DEFAULT_SCOPES) -> Optional[AccessToken]:
+        """Get a user's valid token covering `scopes`; only a missing scope or expiry triggers a refresh"""
+        requested = parse_scopes(scopes)
+        token = await self.token_storage.get_token(user_key, requested)
+        if token and not token.is_expired:
+            return token
+
+        async with self.token_storage.lock(user_key):
+            # Another request for this user may have refreshed while we waited
+            token = await self.token_storage.get_token(user_key, requested)
+            if token and not token.is_expired:
+                return token
+
+            refresh_token = (token and token.refresh_token) or await self.token_storage.get_refresh_token(user_key)
+            if not refresh_token:
+                return None
 
-        log.success(f"Authentication successful! Token expires in {token.expires_in}s")
-        return token
+            try:
+                refreshed = await self.token_manager.refresh_token(
+                    refresh_token, self._refresh_scopes(scopes), tenant=tenant_of(user_key)
+                )
+            except Overloaded:
+                raise  # the tenant is busy, not the token bad: callers shed (503) rather than send users to sign in
+            except Exception as e:
+                log.error("token.refresh_failed user={user} error={error}", user=user_key, error=e)
+                return None
 
-    async def get_valid_token(self) -> Optional[AccessToken]:
-        """Get valid token, refresh if needed"""
-        if not self._current_token:
-            self._current_token = await self.token_storage.get_token("current")
+            if not refreshed.id_token:
+                refreshed.claims = next((t.claims for t in await self.token_storage.get_tokens(user_key) if t.claims), None)
+            await self.token_storage.store_token(user_key, refreshed)
+            log.debug("token.refreshed user={user}", user=user_key)
 
-        if not self._current_token:
+        if refreshed.is_expired or not refreshed.covers(requested):
+            log.warning("token.refresh_insufficient user={user} scopes={scopes}", user=user_key, scopes=scopes)
             return None
+        return refreshed
 
-        if self._current_token.is_expired and self._current_token.refresh_token:
+    @staticmethod
+    def _refresh_scopes(scopes: str) -> str:
+        """Requested scopes plus offline_access, so the response carries a new refresh token"""
+        return scopes if "offline_access" in parse_scopes(scopes) else f"{scopes} offline_access"
+
+    async def get_identity(self, token: AccessToken) -> Dict[str, Any]:
+        """Who the token belongs to: validated id_token claims, or a Graph /me call as fallback"""
+        if token.claims is None and token.id_token and self.id_token_validator:
             try:
-                refreshed = await self.token_manager.refresh_token(
-                    self._current_token.refresh_token,
-                    self._current_token.scope
-                )
-                await self.token_storage.store_token("current", refreshed)
-                self._current_token = refreshed
-                log.info("Token refreshed successfully")
+                token.claims = await self.id_token_validator.validate(token.id_token)
             except Exception as e:
-                log.error(f"Token refresh failed: {e}")
-                return None
+                log.warning("token.id_token_invalid error={error}", error=e)
 
-        return self._current_token if not self._current_token.is_expired else None
+        if token.claims is not None:
+            return identity_from_claims(token.claims)
+        return await self.graph_api.get_user_profile(token.access_token)
 
-    async def get_user_data(self, data_type: str = "profile") -> Dict[str, Any]:
-        """Get user data via Azure CLI Graph API"""
-        token = await self.get_valid_token()
+    async def get_user_data(self, data_type: str, user_key: str, query: Optional[GraphQuery] = None) -> Dict[str, Any]:
+        """Get a user's data via Graph API, projected to the data type's default fields unless `query` says otherwise"""
+        token = await self.get_valid_token(user_key)
         if not token:
             return {"error": "No valid token available"}
 
         try:
             if data_type == "profile":
-                return await self.graph_api.get_user_profile(token.access_token)
+                return await self.graph_api.get_user_profile(token.access_token, query=query)
             elif data_type == "emails":
-                return await self.graph_api.get_user_emails(token.access_token)
+                return await self.graph_api.get_user_emails(token.access_token, query=query)
             elif data_type == "files":
-                return await self.graph_api.get_user_files(token.access_token)
+                return await self.graph_api.get_user_files(token.access_token, query=query)
             else:
-                return await self.graph_api.call(token.access_token, f"/{data_type}")
+                return await self.graph_api.call(token.access_token, f"/{data_type}",
+                                                 query=self.graph_api.query_for(data_type, query))
         except Exception as e:
-            log.error(f"Graph API call failed: {e}")
+            log.error("graph.failed data_type={data_type} error={error}", data_type=data_type, error=e)
             return {"error": str(e)}
 
-    async def logout(self):
-        """Clear stored tokens"""
-        await self.token_storage.remove_token("current")
-        self._current_token = None
-        log.info("Logged out successfully")
+    async def logout(self, user_key: str):
+        """Clear a user's stored tokens"""
+        await self.token_storage.remove_token(user_key)
+        log.info("auth.logout user={user}", user=user_key)
+
+    async def close(self):
+        """Release pooled connections"""
+        await self.token_manager.close()
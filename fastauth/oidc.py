@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+import aiohttp
+import jwt
+
+from fastauth.logs import log
+
+
+class OpenIDMetadataCache:
+    """Per-tenant OpenID discovery documents and JWKS signing keys, cached with a TTL
+
+    At most max_tenants tenants are kept (least recently refreshed go first); tenants whose discovery
+    fails leave nothing behind.
+    """
+
+    def __init__(self, authority: str = "https://login.microsoftonline.com", ttl: float = 24 * 3600,
+                 min_refresh_interval: float = 300, max_tenants: int = 1024):
+        self.authority = authority.rstrip("/")
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.max_tenants = max_tenants
+        self._metadata: Dict[str, dict] = {}
+        self._keys: Dict[str, Dict[str, jwt.PyJWK]] = {}
+        self._fetched_at: "OrderedDict[str, float]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def discovery_url(self, tenant: str) -> str:
+        return f"{self.authority}/{tenant}/v2.0/.well-known/openid-configuration"
+
+    async def get_metadata(self, tenant: str = "common") -> dict:
+        """Discovery document for a tenant, refreshed once it is older than the TTL"""
+        if self._is_stale(tenant):
+            await self.refresh(tenant)
+        return self._metadata[tenant]
+
+    async def get_signing_key(self, kid: str, tenant: str = "common") -> jwt.PyJWK:
+        """Signing key by key id; an unknown kid triggers a (rate-limited) refresh to pick up rotated keys"""
+        if self._is_stale(tenant):
+            await self.refresh(tenant)
+
+        key = self._keys.get(tenant, {}).get(kid)
+        if key is None and time.monotonic() - self._fetched_at.get(tenant, 0) >= self.min_refresh_interval:
+            log.debug("oidc.unknown_kid kid={kid} tenant={tenant}", kid=kid, tenant=tenant)
+            await self.refresh(tenant, force=True)
+            key = self._keys.get(tenant, {}).get(kid)
+
+        if key is None:
+            raise jwt.InvalidTokenError(f"No signing key {kid} for tenant {tenant}")
+        return key
+
+    async def refresh(self, tenant: str = "common", force: bool = False):
+        """Fetch discovery + JWKS; on failure keep serving the previous keys if there are any"""
+        lock = self._locks.setdefault(tenant, asyncio.Lock())
+        async with lock:
+            if not force and not self._is_stale(tenant):
+                return  # another caller refreshed while we waited
+
+            try:
+                async with aiohttp.ClientSession() as session:
+                    metadata = await self._fetch_json(session, self.discovery_url(tenant))
+                    jwks = await self._fetch_json(session, metadata["jwks_uri"])
+            except Exception as e:
+                if tenant not in self._metadata:
+                    if self._locks.get(tenant) is lock:
+                        del self._locks[tenant]  # callers already waiting on it retry on their own
+                    raise
+                log.warning("oidc.refresh_failed tenant={tenant} error={error}", tenant=tenant, error=e)
+                self._fetched_at[tenant] = time.monotonic() - self.ttl + self.min_refresh_interval
+                return
+
+            keys = {}
+            for jwk in jwks.get("keys", []):
+                if jwk.get("kid") and jwk.get("use", "sig") == "sig":
+                    try:
+                        keys[jwk["kid"]] = jwt.PyJWK(jwk)
+                    except jwt.PyJWKError as e:
+                        log.debug("oidc.unusable_key kid={kid} error={error}", kid=jwk["kid"], error=e)
+
+            self._metadata[tenant] = metadata
+            self._keys[tenant] = keys
+            self._fetched_at[tenant] = time.monotonic()
+            self._fetched_at.move_to_end(tenant)
+            log.debug("oidc.keys_loaded tenant={tenant} keys={keys}", tenant=tenant, keys=len(keys))
+            while len(self._fetched_at) > self.max_tenants:
+                self._forget(next(iter(self._fetched_at)))
+
+    def _forget(self, tenant: str):
+        for cache in (self._metadata, self._keys, self._fetched_at, self._locks):
+            cache.pop(tenant, None)
+
+    def _is_stale(self, tenant: str) -> bool:
+        fetched_at = self._fetched_at.get(tenant)
+        return fetched_at is None or time.monotonic() - fetched_at >= self.ttl
+
+    @staticmethod
+    async def _fetch_json(session: aiohttp.ClientSession, url: str) -> dict:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise RuntimeError(f"OpenID metadata request failed: {response.status} {url}")
+            return await response.json(content_type=None)
+
+
+class IdTokenValidator:
+    """Validates id_tokens locally against the cached JWKS"""
+
+    ALGORITHMS = ("RS256",)
+
+    def __init__(self, client_id: str, metadata: OpenIDMetadataCache, tenant: str = "common", leeway: float = 60):
+        self.client_id = client_id
+        self.metadata = metadata
+        self.tenant = tenant
+        self.leeway = leeway
+
+    async def validate(self, id_token: str) -> Dict[str, Any]:
+        """Verify signature, audience, lifetime and issuer; returns the claims"""
+        header = jwt.get_unverified_header(id_token)
+        if header.get("alg") not in self.ALGORITHMS:
+            raise jwt.InvalidAlgorithmError(f"Unsupported id_token algorithm: {header.get('alg')}")
+
+        key = await self.metadata.get_signing_key(header.get("kid"), self.tenant)
+        claims = jwt.decode(
+            id_token,
+            key.key,
+            algorithms=list(self.ALGORITHMS),
+            audience=self.client_id,
+            leeway=self.leeway,
+            options={"require": ["exp", "iat", "aud", "iss"], "verify_iss": False},
+        )
+
+        # Multi-tenant discovery documents publish an issuer template with a {tenantid} placeholder
+        metadata = await self.metadata.get_metadata(self.tenant)
+        expected_issuer = metadata["issuer"].replace("{tenantid}", claims.get("tid", ""))
+        if claims["iss"] != expected_issuer:
+            raise jwt.InvalidIssuerError(f"Unexpected id_token issuer: {claims['iss']}")
+        return claims
+
+
+def identity_from_claims(claims: Dict[str, Any]) -> Dict[str, Any]:
+    """Graph-profile-shaped identity from validated id_token claims"""
+    identity = {
+        "id": claims.get("oid") or claims.get("sub"),
+        "tenantId": claims.get("tid"),
+        "displayName": claims.get("name"),
+        "mail": claims.get("email"),
+        "userPrincipalName": claims.get("preferred_username"),
+    }
+    return {k: v for k, v in identity.items() if v}
@@ -1,108 +1,53 @@
+import asyncio
 import secrets
 import threading
-from typing import Dict, Optional
-import json
-from datetime import datetime, timedelta
-
-import uvicorn
-from async_property import AwaitLoader, async_cached_property
-from fastapi import FastAPI, Request, Response, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
-from loguru import logger as log
+import re
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set, Tuple
+from pathlib import Path
+from urllib.parse import urlencode
+
+from fastapi import FastAPI, Request, HTTPException, Query, Header
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
-from pyzurecli import AzureCLI, AzureCLIAppRegistration
-from fastapi.templating import Jinja2Templates
-import httpx
-from fastapi import HTTPException
-
-from oauth_token_manager import (
-    MultiTenantTokenManager,
-    TokenStorage,
-    ManagedOAuthClient,
-    AccessToken,
-    PKCEChallenge, GraphAPI
-)
-
-def add_oauth(app, oauth_url="http://localhost:8080"):
-    """Dead simple OAuth with automatic session management"""
-    @app.middleware("http")
-    async def oauth_middleware(request: Request, call_next):
-        # Get or create session
-        session = request.cookies.get("session")
-        if not session:
-            log.debug(f"[FastAuth] Couldn't find a session for {request.headers}")
-            session = secrets.token_urlsafe(32)
-            log.debug(f"[FastAuth]: Created a cookie!:\nsession={session}")
-
-        # Skip static files
-        if request.url.path.startswith("/static"):
-            return await call_next(request)
-
-        # Try to get user from OAuth service
-        async with httpx.AsyncClient() as client:
-            log.debug(f"[FastAuth] Attempting to get a user from OAuth!")
-            try:
-                response = await client.post(f"{oauth_url}/api/exchange", json={"session_token": session})
-
-                if response.status_code == 200:
-                    # Got user - set session cookie and continue
-                    request.state.user = response.json()
-                    response_obj = await call_next(request)
-                    if not request.cookies.get("session"):
-                        response_obj.set_cookie("session", session, max_age=3600*8)
-                    return response_obj
-
-                elif response.status_code == 302:
-                    # Need OAuth - redirect with return URL and session
-                    return_url = str(request.url)
-                    redirect_response = RedirectResponse(f"{oauth_url}/?return_url={return_url}")
-                    redirect_response.set_cookie("session", session, max_age=3600*8)
-                    return redirect_response
-
-            except:
-                pass
-
-        # Continue without user
-        log.warning("[FastAuth]: Continuing without user...")
-        response_obj = await call_next(request)
-        if not request.cookies.get("session"):
-            response_obj.set_cookie("session", session, max_age=3600*8)
-        return response_obj
-
-class UserCache:
-    """In-memory user cache - super lightweight"""
-    def __init__(self):
-        self._users: Dict[str, dict] = {}
-
-    def get_user(self, user_id: str) -> Optional[dict]:
-        """Get cached user object"""
-        user = self._users.get(user_id)
-        if user and datetime.fromisoformat(user["expires_at"]) > datetime.utcnow():
-            return user
-
-    def store_user(self, user_id: str, user_data: dict, microsoft_token: AccessToken):
-        """Cache user object with Microsoft data"""
-        self._users[user_id] = {
-            "id": user_id,
-            "email": user_data.get("mail") or user_data.get("userPrincipalName", ""),
-            "name": user_data.get("displayName", "Unknown User"),
-            "profile": user_data,
-            "authenticated": True,
-            "authenticated_at": datetime.utcnow().isoformat(),
-            "expires_at": (datetime.utcnow() + timedelta(hours=8)).isoformat(),
-            "microsoft_token_expires": microsoft_token.expires_in,
-            # Cache Microsoft data to avoid API calls
-            "cached_profile": user_data,
-            "has_mail_access": "Mail.Read" in microsoft_token.scope,
-            "has_files_access": "Files.Read" in microsoft_token.scope
-        }
-
-    def remove_user(self, user_id: str):
-        """Remove user from cache"""
-        self._users.pop(user_id, None)
-
-# Global user cache
-user_cache = UserCache()
+
+from fastauth import events
+from fastauth.admission import AdmissionController, Overloaded
+from fastauth.events import ChangeFeed
+from fastauth.logs import log, sampled
+from fastauth.middleware import SESSION_MAX_AGE, add_oauth  # noqa: F401 - add_oauth re-exported for existing imports
+from fastauth.oauth_token_manager import AccessToken, PKCEChallenge, DEFAULT_SCOPES, FULL_PROFILE, GraphQuery
+from fastauth.oidc import OpenIDMetadataCache
+from fastauth.snapshot import UserCacheSnapshots
+from fastauth.user_cache import UserCache, session_key
+
+_user_cache: Optional[UserCache] = None
+
+
+def get_user_cache() -> UserCache:
+    """Process-wide user cache, created on first use"""
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = UserCache()
+    return _user_cache
+
+
+_change_feed: Optional[ChangeFeed] = None
+
+
+def get_change_feed() -> ChangeFeed:
+    """Process-wide feed of user cache changes, subscribed to the user cache on first use"""
+    global _change_feed
+    if _change_feed is None:
+        _change_feed = ChangeFeed()
+        get_user_cache().add_listener(_change_feed.publish)
+    return _change_feed
+
+# Tenant GUIDs and verified domains; anything else never reaches an authority URL
+TENANT_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9.-]{0,252}$")
+
+EVENT_HEARTBEAT_SECONDS = 15
+PURGE_INTERVAL_SECONDS = 60
 
 # Pydantic models
 class SessionExchange(BaseModel):
@@ -119,62 +64,153 @@ class CachedUser(BaseModel):
     has_mail_access: bool
     has_files_access: bool
 
-templates = Jinja2Templates(directory="templates")
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+PAGE_TEMPLATES = ("login.html", "success.html", "error.html", "dashboard.html", "admin-consent.html")
+
+_templates = None
+_static_assets = None
+
+
+def get_static_assets():
+    """Hashed, precompressed package static files, loaded on first use"""
+    global _static_assets
+    if _static_assets is None:
+        from fastauth.assets import StaticAssets
+        _static_assets = StaticAssets()
+    return _static_assets
+
+
+def get_templates():
+    """Package templates, compiled once: no reload checks, unbounded template cache"""
+    global _templates
+    if _templates is None:
+        import jinja2
+        from fastapi.templating import Jinja2Templates
+
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+            autoescape=jinja2.select_autoescape(),
+            auto_reload=False,
+            cache_size=-1,
+        )
+        env.globals["static_url"] = get_static_assets().url
+        for name in PAGE_TEMPLATES:
+            env.get_template(name)
+        _templates = Jinja2Templates(env=env)
+    return _templates
+
+
+def __getattr__(name):
+    # Lazy module attributes: `from fastauth.server import user_cache` keeps working
+    if name == "user_cache":
+        return get_user_cache()
+    if name == "templates":
+        return get_templates()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class AuthUrlBuilder:
-    """Builds multi-tenant OAuth URLs"""
+    """Builds multi-tenant OAuth URLs from per-endpoint templates"""
+
+    MAX_TEMPLATES = 1024
 
-    def __init__(self, client_id: str, redirect_uri: str = "http://localhost:8080/callback"):
+    def __init__(self, client_id: str, redirect_uri: str = "http://localhost:8080/callback",
+                 authority: str = "https://login.microsoftonline.com", tenant: str = "common",
+                 metadata: Optional[OpenIDMetadataCache] = None):
         self.client_id = client_id
         self.redirect_uri = redirect_uri
+        self.authority = authority.rstrip('/')
+        self.tenant = tenant
+        self.metadata = metadata
+        self.endpoint = self._well_known_endpoint(tenant)
+        self._templates: Dict[Tuple[str, str], str] = {}
+
+    async def endpoint_for(self, tenant: str) -> str:
+        """Authorization endpoint from the tenant's cached discovery document (well-known layout without one)"""
+        if self.metadata is None:
+            return self._well_known_endpoint(tenant)
+        try:
+            metadata = await self.metadata.get_metadata(tenant)
+            return metadata["authorization_endpoint"]
+        except Exception as e:
+            log.warning("auth.discovery_failed tenant={tenant} error={error}", tenant=tenant, error=e)
+            return self._well_known_endpoint(tenant)
+
+    async def build_auth_url(self, scopes: str, pkce_challenge: PKCEChallenge, state: str,
+                             tenant: Optional[str] = None) -> str:
+        """Build multi-tenant OAuth URL; only the per-flow parameters are encoded on each call"""
+        endpoint = await self.endpoint_for(tenant or pkce_challenge.tenant or self.tenant)
+        template = self._templates.get((endpoint, scopes))
+        if template is None:
+            if len(self._templates) >= self.MAX_TEMPLATES:
+                self._templates.clear()
+            static_params = urlencode({
+                'client_id': self.client_id,
+                'response_type': 'code',
+                'redirect_uri': self.redirect_uri,
+                'scope': scopes,
+                'response_mode': 'query',
+            })
+            template = self._templates[(endpoint, scopes)] = f"{endpoint}?{static_params}&"
 
-    def build_auth_url(self, scopes: str, pkce_challenge: PKCEChallenge, state: str) -> str:
-        """Build multi-tenant OAuth URL"""
-        endpoint = "https://login.microsoftonline.com/common/oauth2/v2.0/authorize"
-
-        params = {
-            'client_id': self.client_id,
-            'response_type': 'code',
-            'redirect_uri': self.redirect_uri,
-            'scope': scopes,
-            'response_mode': 'query',
+        return template + urlencode({
             'code_challenge': pkce_challenge.code_challenge,
             'code_challenge_method': pkce_challenge.code_challenge_method,
             'state': state
-        }
+        })
 
-        query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-        return f"{endpoint}?{query_string}"
+    def _well_known_endpoint(self, tenant: str) -> str:
+        return f"{self.authority}/{tenant}/oauth2/v2.0/authorize"
 
 
 class AuthCallbackServer(FastAPI):
     """FastAPI server for multi-tenant OAuth callbacks"""
     debug = True
 
-    def __init__(self, auth_server):
-        super().__init__()
+    def __init__(self, auth_server, exchange_admission: Optional[AdmissionController] = None,
+                 snapshot_path: Optional[Path] = None, snapshot_interval: float = 60):
+        super().__init__(lifespan=self._lifespan)
         self.auth_server = auth_server
+        # Bounds the cache-miss path of /api/exchange; cache hits never wait on it
+        self.exchange_admission = exchange_admission or AdmissionController("exchange")
+        self.user_cache = get_user_cache()
+        self.change_feed = get_change_feed()
+        self.templates = get_templates()
+        get_static_assets().mount(self)
+        # Warm restarts: the user cache is restored from (and periodically written to) snapshot_path
+        self.snapshots = UserCacheSnapshots(self.user_cache, snapshot_path, snapshot_interval) if snapshot_path else None
+        self._background_tasks = []
+        self._revalidations: Dict[str, asyncio.Task] = {}
+        self._token_drops: Set[asyncio.Task] = set()
+        # Once a user's last session ends nothing can use their tokens, so they go too
+        self.user_cache.add_listener(self._on_user_change)
 
         @self.get("/")
-        async def start_auth(request: Request):
-            """Start multi-tenant OAuth flow"""
+        async def start_auth(request: Request, tenant: Optional[str] = None):
+            """Start multi-tenant OAuth flow (optionally against one tenant's authority)"""
+            if tenant is not None and not TENANT_PATTERN.match(tenant):
+                return self._error_response(request, "Invalid tenant", tenant[:64])
             try:
                 state = secrets.token_urlsafe(32)
+                # The flow belongs to this browser: /callback only completes it for the same session
+                session = request.cookies.get("session") or secrets.token_urlsafe(32)
                 oauth_client = await self.auth_server.oauth_client
-                pkce_challenge = oauth_client.token_manager.create_pkce_challenge(state)
+                pkce_challenge = oauth_client.token_manager.create_pkce_challenge(state, tenant, session_key(session))
 
                 auth_url_builder = await self.auth_server.auth_url_builder
-                auth_url = auth_url_builder.build_auth_url(
-                    scopes="User.Read Mail.Read Files.Read offline_access",
+                auth_url = await auth_url_builder.build_auth_url(
+                    scopes=DEFAULT_SCOPES,
                     pkce_challenge=pkce_challenge,
                     state=state
                 )
 
-                log.debug(f"[{self}]: 🔐 Starting OAuth flow with state: {state[:8]}...")
-                log.debug(f"[{self}]: 🔗 Auth URL: {auth_url}")
-                return RedirectResponse(auth_url)
+                if sampled("auth.start"):
+                    log.debug("auth.start state={state}", state=state[:8])
+                response = RedirectResponse(auth_url)
+                if not request.cookies.get("session"):
+                    response.set_cookie("session", session, max_age=SESSION_MAX_AGE)
+                return response
             except Exception as e:
-                log.debug(f"[{self}]: ❌ Error starting auth: {e}")
+                log.error("auth.start_failed error={error}", error=e)
                 return HTMLResponse(f"<h1>Error starting auth: {str(e)}</h1>", status_code=500)
 
         @self.get("/callback")
@@ -185,9 +221,6 @@ class AuthCallbackServer(FastAPI):
             state = query_params.get('state')
             error = query_params.get('error')
 
-            log.debug(f"[{self}]: 🔄 Callback received - State: {state[:8] if state else 'None'}...")
-            log.debug(f"[{self}]: 🔑 Auth code: {auth_code[:20] if auth_code else 'None'}...")
-
             if error:
                 return self._error_response(request, error, query_params.get('error_description'))
 
@@ -202,36 +235,50 @@ class AuthCallbackServer(FastAPI):
 
                 # Debug: Check if PKCE challenge exists
                 pkce_challenge = oauth_client.token_manager.consume_pkce_challenge(state)
-                log.debug(f"[{self}]: 🔍 PKCE challenge found: {pkce_challenge is not None}")
 
                 if not pkce_challenge:
-                    # Debug: Show available states
-                    available_states = list(oauth_client.token_manager._pkce_challenges.keys())
-                    log.debug(f"[{self}]: 🔍 Available states: {[s[:8] for s in available_states]}")
+                    # Stored states are listed on /debug
+                    log.info("auth.callback_unknown_state state={state}", state=state[:8])
                     return self._error_response(request, f"Invalid state parameter", "Received: {state[:8]}...")
 
-                token = await oauth_client.authenticate_with_code(
+                # A state replayed from another browser would bind this one's session to someone else (login CSRF)
+                session = request.cookies.get("session")
+                if not session or pkce_challenge.session != session_key(session):
+                    log.warning("auth.callback_session_mismatch state={state}", state=state[:8])
+                    return self._error_response(request, "Sign-in was started in another browser session",
+                                                "Start again from this browser.", status_code=403)
+
+                # Identity comes from the validated id_token; Graph is only hit if there isn't one
+                user = await oauth_client.authenticate_with_code(
                     auth_code,
-                    scopes="User.Read Mail.Read Files.Read offline_access",
-                    pkce_verifier=pkce_challenge.code_verifier
+                    scopes=DEFAULT_SCOPES,
+                    pkce_verifier=pkce_challenge.code_verifier,
+                    tenant=pkce_challenge.tenant
                 )
-
-                # Get user info via CLI
-                user_data = await oauth_client.get_user_data("profile")
+                user_data = user.identity
                 user_display = user_data.get('displayName', 'User')
                 user_email = user_data.get('mail') or user_data.get('userPrincipalName', 'No email')
 
+                # Tie the browser session to this user so /api/exchange can find their token
+                self.user_cache.store_user(user.user_key, user_data, user.token)
+                self.user_cache.bind_session(session, user.user_key)
+
+                response = None
                 try:
                     return_url = request.query_params.get("return_url", "http://localhost:8081/")
                     if return_url is not None:
-                        log.debug(f"{self}: Found return url! Redirecting to {return_url}!")
-                        return RedirectResponse(return_url)
+                        response = RedirectResponse(return_url)
                 except Exception: pass
 
-                return self._success_response(request, token, user_display, user_email)
+                return response or self._success_response(request, user.token, user_display, user_email)
 
+            except Overloaded as e:
+                log.warning("auth.callback_shed error={error}", error=e)
+                response = self._error_response(request, "Sign-in is busy", "Try again in a moment.", status_code=503)
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
             except Exception as e:
-                log.debug(f"[{self}]: ❌ Callback error: {e}")
+                log.warning("auth.callback_failed error={error}", error=e)
                 return self._error_response(request, f"Authentication failed: {str(e)}")
 
         @self.get("/debug")
@@ -243,7 +290,12 @@ class AuthCallbackServer(FastAPI):
 
                 debug_info = {
                     "stored_challenges": len(challenges),
-                    "challenge_states": [state[:8] + "..." for state in challenges.keys()]
+                    "challenge_states": [state[:8] + "..." for state in challenges.keys()],
+                    "exchange_admission": {
+                        "active": self.exchange_admission.active,
+                        "waiting": self.exchange_admission.waiting,
+                        **self.exchange_admission.stats.as_dict()
+                    }
                 }
 
                 return debug_info
@@ -251,32 +303,32 @@ class AuthCallbackServer(FastAPI):
                 return {"error": str(e)}
 
         @self.get("/profile")
-        async def get_profile():
-            """Get user profile via Azure CLI"""
-            return await self._get_user_data("profile")
+        async def get_profile(request: Request):
+            """Get the signed-in user's full Graph profile"""
+            return await self._get_user_data("profile", self._session_user_key(request), query=FULL_PROFILE)
 
         @self.get("/emails")
-        async def get_emails():
-            """Get user emails via Azure CLI"""
-            return await self._get_user_data("emails")
+        async def get_emails(request: Request):
+            """Get the signed-in user's emails"""
+            return await self._get_user_data("emails", self._session_user_key(request))
 
         @self.get("/files")
-        async def get_files():
-            """Get user files via Azure CLI"""
-            return await self._get_user_data("files")
+        async def get_files(request: Request):
+            """Get the signed-in user's files"""
+            return await self._get_user_data("files", self._session_user_key(request))
 
         @self.get("/dashboard")
         async def dashboard(request: Request):
             """User dashboard with all data"""
             try:
                 oauth_client = await self.auth_server.oauth_client
+                user_key = self._session_user_key(request)
 
-                profile = await oauth_client.get_user_data("profile")
-                emails = await oauth_client.get_user_data("emails")
-                files = await oauth_client.get_user_data("files")
+                profile = await oauth_client.get_user_data("profile", user_key)
+                emails = await oauth_client.get_user_data("emails", user_key)
+                files = await oauth_client.get_user_data("files", user_key)
 
-                return templates.TemplateResponse("dashboard.html", {
-                    "request": request,
+                return self.templates.TemplateResponse(request, "dashboard.html", {
                     "user_display_name": "null",
                     "user_email": "null",
                     "profile_json": profile,
@@ -288,10 +340,13 @@ class AuthCallbackServer(FastAPI):
                 return HTMLResponse(f"<h1>Error: {str(e)}</h1>", status_code=500)
 
         @self.get("/logout")
-        async def logout(request):
+        async def logout(request: Request):
             """Logout and clear tokens"""
-            oauth_client = await self.auth_server.oauth_client
-            await oauth_client.logout()
+            user_key = self._session_user_key(request)
+            if user_key:
+                oauth_client = await self.auth_server.oauth_client
+                await oauth_client.logout(user_key)
+                self.user_cache.remove_user(user_key)
 
             return HTMLResponse("""
             <html>
@@ -306,11 +361,9 @@ class AuthCallbackServer(FastAPI):
         @self.get("/admin-consent")
         async def admin_consent(request: Request):
             """Show admin consent URL"""
-            app_registration = await self.auth_server.app_registration
-            consent_url = await app_registration.generate_admin_consent_url()
+            consent_url = await self.auth_server.admin_consent_url
 
-            return templates.TemplateResponse("admin-consent.html", {
-                "request": request,
+            return self.templates.TemplateResponse(request, "admin-consent.html", {
                 "admin_consent_url": consent_url,
             })
 
@@ -321,45 +374,42 @@ class AuthCallbackServer(FastAPI):
             If not authenticated, returns redirect to OAuth flow
             """
             try:
-                # Extract user ID from session token (simplified - adjust for your session format)
-                # For demo: assume session_token contains user identifier
-                user_id = self._extract_user_id_from_session(request.session_token)
-
-                # Check if user is cached and valid
-                cached_user = user_cache.get_user(user_id)
-                if cached_user:
-                    log.debug(f"✅ Returning cached user: {user_id}")
-                    return CachedUser(**cached_user)
-
-                # User not cached or expired - check if OAuth is available
-                oauth_client = await self.auth_server.oauth_client
-                microsoft_token = await oauth_client.get_valid_token()
-
-                if not microsoft_token:
-                    # No OAuth token - trigger OAuth flow
-                    log.debug(f"🔐 No OAuth token for {user_id}, triggering OAuth flow")
+                # Only sessions bound at /callback identify a user; the token itself is never trusted as a user key
+                user_id = self.user_cache.resolve_session(request.session_token)
+                if user_id is None:
+                    if sampled("exchange.unbound"):
+                        log.debug("exchange.unbound_session")
                     raise HTTPException(
                         status_code=302,
                         detail="OAuth required",
-                        headers={"Location": "/"}  # Redirect to OAuth flow
+                        headers={"Location": "/"}
                     )
 
-                # Fetch user data and cache it
-                log.debug(f"📥 Fetching and caching user data for: {user_id}")
-                user_data = await oauth_client.get_user_data("profile")
-
-                # Cache the user
-                actual_user_id = user_data.get("userPrincipalName") or user_data.get("mail") or user_id
-                user_cache.store_user(actual_user_id, user_data, microsoft_token)
+                # Check if user is cached and valid; stale users are served as-is and refreshed behind the response
+                cached_user, stale = self.user_cache.lookup(user_id)
+                if cached_user:
+                    if stale:
+                        self._revalidate(user_id)
+                    if sampled("exchange.hit"):
+                        log.debug("exchange.hit user={user}", user=user_id)
+                    return CachedUser(**cached_user)
 
-                # Return cached user
-                cached_user = user_cache.get_user(actual_user_id)
-                return CachedUser(**cached_user)
+                async with self.exchange_admission.admit():
+                    return await self._exchange_miss(user_id)
 
+            except Overloaded as e:
+                if sampled("exchange.shed"):
+                    log.warning("exchange.shed active={active} waiting={waiting}",
+                                active=self.exchange_admission.active, waiting=self.exchange_admission.waiting)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Auth server busy, retry shortly",
+                    headers={"Retry-After": str(e.retry_after)}
+                )
             except HTTPException:
                 raise  # Re-raise HTTP exceptions (like redirects)
             except Exception as e:
-                log.error(f"❌ Exchange error: {e}")
+                log.error("exchange.failed error={error}", error=e)
                 raise HTTPException(
                     status_code=500,
                     detail=f"User exchange failed: {str(e)}"
@@ -368,7 +418,7 @@ class AuthCallbackServer(FastAPI):
         @self.get("/api/user/{user_id}", response_model=CachedUser)
         async def get_cached_user(user_id: str):
             """Get cached user by ID - no external API calls"""
-            cached_user = user_cache.get_user(user_id)
+            cached_user = self.user_cache.get_user(user_id)
             if not cached_user:
                 raise HTTPException(status_code=404, detail="User not found or expired")
 
@@ -376,61 +426,199 @@ class AuthCallbackServer(FastAPI):
 
         @self.delete("/api/user/{user_id}")
         async def logout_user(user_id: str):
-            """Remove user from cache (logout)"""
-            user_cache.remove_user(user_id)
+            """Remove user from cache and drop their tokens (logout)"""
+            self.user_cache.remove_user(user_id)
+            oauth_client = await self.auth_server.oauth_client
+            await oauth_client.logout(user_id)
             return {"status": "logged_out", "user_id": user_id}
 
         @self.get("/api/users")
-        async def list_cached_users():
-            """List all cached users (admin endpoint)"""
+        async def list_cached_users(
+                cursor: Optional[str] = None,
+                limit: int = Query(100, ge=1, le=1000),
+                tenant: Optional[str] = None,
+                email: Optional[str] = None,
+                count_only: bool = False
+        ):
+            """List cached users in expiry order, one page at a time (admin endpoint)"""
+            count = self.user_cache.count_users(tenant=tenant, email=email)
+            if count_only:
+                return {"cached_users": count}
+
+            try:
+                users, next_cursor = self.user_cache.list_users(cursor, limit, tenant=tenant, email=email)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
             return {
-                "cached_users": len(user_cache._users),
+                "cached_users": count,
                 "users": [
                     {
                         "id": user["id"],
                         "name": user["name"],
                         "email": user["email"],
+                        "tenant_id": user["tenant_id"],
                         "authenticated_at": user["authenticated_at"],
                         "expires_at": user["expires_at"]
                     }
-                    for user in user_cache._users.values()
-                ]
+                    for user in users
+                ],
+                "next_cursor": next_cursor
             }
+        @self.get("/api/events")
+        async def user_events(
+                request: Request,
+                since: Optional[str] = Query(None, max_length=64),
+                last_event_id: Optional[str] = Header(None, max_length=64)
+        ):
+            """
+            Server-sent stream of user cache changes (store/refresh/expire/remove)
+            Resume with Last-Event-ID (or ?since=<event id>); a 'reset' event means drop everything and start over
+            """
+            resume_from = last_event_id if last_event_id is not None else since
+            return StreamingResponse(
+                self._event_stream(request, resume_from),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        if self.snapshots:
+            await self.snapshots.restore()
+            self._background_tasks.append(asyncio.create_task(self.snapshots.run()))
+        # Expiry events must fire even when nothing else touches the cache
+        self._background_tasks.append(asyncio.create_task(self._purge_expired_periodically()))
+        yield
+
+        for task in self._background_tasks + list(self._revalidations.values()):
+            task.cancel()
+        if self.snapshots:
+            await self.snapshots.save()
+        oauth_client = await self.auth_server.oauth_client
+        await oauth_client.close()
+
+    async def _exchange_miss(self, user_id: str) -> "CachedUser":
+        """Slow path of /api/exchange: token lookup (maybe a refresh) plus identity, then cache the user"""
+        # Another request for this user may have filled the cache while we waited for a slot
+        cached_user = self.user_cache.get_user(user_id)
+        if cached_user:
+            return CachedUser(**cached_user)
 
+        log.debug("exchange.miss user={user}", user=user_id)
+        cached_user = await self._load_user(user_id)
+        if not cached_user:
+            # No OAuth token - trigger OAuth flow
+            log.debug("exchange.no_token user={user}", user=user_id)
+            raise HTTPException(
+                status_code=302,
+                detail="OAuth required",
+                headers={"Location": "/"}  # Redirect to OAuth flow
+            )
+        return CachedUser(**cached_user)
+
+    async def _load_user(self, user_id: str) -> Optional[dict]:
+        """Valid token (refreshed if needed) plus identity, cached; None if the user has no usable token"""
+        oauth_client = await self.auth_server.oauth_client
+        microsoft_token = await oauth_client.get_valid_token(user_id)
+        if not microsoft_token:
+            return None
+
+        user_data = await oauth_client.get_identity(microsoft_token)
+        self.user_cache.store_user(user_id, user_data, microsoft_token)
+        return self.user_cache.get_user(user_id)
+
+    def _revalidate(self, user_id: str):
+        """Start a background refresh of a stale user, unless one is already running"""
+        if user_id not in self._revalidations:
+            task = asyncio.create_task(self._revalidate_user(user_id))
+            self._revalidations[user_id] = task
+            task.add_done_callback(lambda _: self._revalidations.pop(user_id, None))
+
+    async def _revalidate_user(self, user_id: str):
+        """Refresh a stale user's token and profile; if that fails the user hard-expires"""
+        try:
+            async with self.exchange_admission.try_admit():
+                refreshed = await self._load_user(user_id)
+        except Overloaded:
+            return  # busy: skip without queueing; the stale entry keeps being served and the next hit tries again
+        except Exception as e:
+            log.warning("exchange.revalidate_failed user={user} error={error}", user=user_id, error=e)
+            refreshed = None
+
+        if refreshed is None:
+            # Next exchange takes the miss path (and re-login if there really is no token)
+            self.user_cache.expire_user(user_id)
 
-    async def _get_user_data(self, data_type: str):
+    def _on_user_change(self, event: str, user_id: str, tenant_id: Optional[str]):
+        if event != events.REMOVE:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop yet, so no tokens either
+        task = loop.create_task(self._drop_tokens(user_id))
+        self._token_drops.add(task)
+        task.add_done_callback(self._token_drops.discard)
+
+    async def _drop_tokens(self, user_id: str):
+        oauth_client = await self.auth_server.oauth_client
+        await oauth_client.token_storage.remove_token(user_id)
+
+    async def _event_stream(self, request: Request, since: Optional[str]):
+        """Encode change feed events as SSE, with comment heartbeats to keep idle connections open"""
+        yield f"retry: 1000\n: last-event-id {self.change_feed.last_event_id}\n\n"
+        # Ends when the subscriber is cut off for falling behind; the client reconnects with Last-Event-ID
+        async for event in self.change_feed.subscribe(since, idle_timeout=EVENT_HEARTBEAT_SECONDS):
+            if event is not None:
+                yield event.to_sse()
+            elif await request.is_disconnected():
+                return
+            else:
+                yield ": heartbeat\n\n"
+
+    async def _purge_expired_periodically(self):
+        while True:
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+            self.user_cache.purge_expired()
+
+    async def _get_user_data(self, data_type: str, user_key: Optional[str], query: Optional[GraphQuery] = None):
         """Get user data and return as JSON"""
+        if not user_key:
+            return {"error": "Not signed in"}
         try:
             oauth_client = await self.auth_server.oauth_client
-            data = await oauth_client.get_user_data(data_type)
+            data = await oauth_client.get_user_data(data_type, user_key, query=query)
             return data
         except Exception as e:
             return {"error": str(e)}
 
-    def _error_response(self, request: Request, error: str, description: str = None):
+    def _session_user_key(self, request: Request) -> Optional[str]:
+        """User key bound to the request's session cookie"""
+        session = request.cookies.get("session")
+        return self.user_cache.resolve_session(session) if session else None
+
+    def _error_response(self, request: Request, error: str, description: str = None, status_code: int = 200):
         """Generate error response"""
-        return templates.TemplateResponse("error.html", {
-            "request": request,
+        return self.templates.TemplateResponse(request, "error.html", {
             "error_message": error,
             "error_description": description
-        })
+        }, status_code=status_code)
 
     def _success_response(self, request: Request, token: AccessToken, user_display: str, user_email: str):
         """Generate success response"""
 
-        return templates.TemplateResponse("success.html", {
-            "request": request,
+        return self.templates.TemplateResponse(request, "success.html", {
             "user_display_name": user_display,
             "user_email": user_email,
-            "token.expires_in": token.expires_in,
-            "token.scope": token.scope,
+            "expires_in": token.expires_in,
+            "scope": token.scope,
             "refresh_token": token.refresh_token
         })
 
     def _dashboard_html(self, request: Request, profile: dict, emails: dict, files: dict):
         """Generate dashboard HTML"""
-        return templates.TemplateResponse("dashboard.html", {
-            "request": request,
+        return self.templates.TemplateResponse(request, "dashboard.html", {
             "user_display_name": "null",
             "user_email": "null",
             "profile_json": profile,
@@ -438,24 +626,15 @@ class AuthCallbackServer(FastAPI):
             "files_json": files
         })
 
-    def _extract_user_id_from_session(self, session_token: str) -> str:
-        """Extract user ID from session token - implement based on your session format"""
-        try:
-            import jwt
-            payload = jwt.decode(session_token, options={"verify_signature": False})
-            return payload.get("user_id") or payload.get("sub") or payload.get("email")
-        except:
-            # Fallback: treat as direct user identifier
-            return session_token
-
 
 class ServerManager:
     """Manages FastAPI server lifecycle"""
 
-    def __init__(self, app: FastAPI, host: str = "localhost", port: int = 8080):
+    def __init__(self, app: FastAPI, host: str = "localhost", port: int = 8080, access_log: bool = False):
         self.app = app
         self.host = host
         self.port = port
+        self.access_log = access_log  # uvicorn's per-request access lines are synchronous stderr writes
         self._server_thread = None
 
     def start(self):
@@ -465,7 +644,8 @@ class ServerManager:
             return
 
         def run_server():
-            uvicorn.run(self.app, host=self.host, port=self.port, log_level="info")
+            import uvicorn
+            uvicorn.run(self.app, host=self.host, port=self.port, log_level="info", access_log=self.access_log)
 
         self._server_thread = threading.Thread(target=run_server, daemon=True)
         self._server_thread.start()
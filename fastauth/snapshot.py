@@ -0,0 +1,132 @@
+"""
+On-disk snapshots of the UserCache, so a restart doesn't send every active user down the miss path.
+
+File layout: MAGIC, then length-prefixed records
+
+    kind (u8) | expires_ts (f64) | length (u32) | JSON payload (length bytes)
+
+Expiry sits in the fixed-size header so restore skips expired records without decoding them.
+Only the user cache is written (profiles and session bindings); tokens never touch the disk, and
+sessions are stored as the cache holds them, as digests, so a snapshot can't be replayed as cookies.
+"""
+import asyncio
+import json
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from fastauth.logs import log
+from fastauth.user_cache import UserCache
+
+MAGIC = b"FASNAP2\n"  # 2: hashed session keys
+RECORD = struct.Struct("<BdI")
+USER, SESSION = 1, 2
+
+FILENAME = "fastauth.snapshot"  # suggested name for FASTAUTH_SNAPSHOT_PATH (git-ignored)
+
+# Cached user objects carry the Graph profile twice ("profile" and "cached_profile"); store it once
+_DUPLICATE_FIELDS = {"cached_profile": "profile"}
+
+
+def encode(users: List[Tuple[float, dict]], sessions: List[Tuple[float, str, str]]) -> bytes:
+    """Serialize exported cache entries"""
+    chunks = [MAGIC]
+    for expires_ts, user in users:
+        user = {k: v for k, v in user.items() if k not in _DUPLICATE_FIELDS}
+        payload = json.dumps(user, separators=(",", ":")).encode()
+        chunks += (RECORD.pack(USER, expires_ts, len(payload)), payload)
+    for expires_ts, session, user_id in sessions:
+        payload = json.dumps([session, user_id], separators=(",", ":")).encode()
+        chunks += (RECORD.pack(SESSION, expires_ts, len(payload)), payload)
+    return b"".join(chunks)
+
+
+def decode(data: bytes, now: Optional[float] = None) -> Tuple[List[Tuple[float, dict]], List[Tuple[float, str, str]]]:
+    """Unexpired entries from a snapshot; a truncated tail is ignored"""
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a FastAuth snapshot")
+    now = now or time.time()
+    users, sessions = [], []
+    for kind, expires_ts, start, end in _records(data, len(MAGIC)):
+        if expires_ts <= now:
+            continue
+        if kind == USER:
+            user = json.loads(data[start:end])
+            for field, source in _DUPLICATE_FIELDS.items():
+                user[field] = user.get(source)
+            users.append((expires_ts, user))
+        elif kind == SESSION:
+            session, user_id = json.loads(data[start:end])
+            sessions.append((expires_ts, session, user_id))
+    return users, sessions
+
+
+def _records(data: bytes, offset: int) -> Iterator[Tuple[int, float, int, int]]:
+    """(kind, expires_ts, payload start, payload end) for each complete record"""
+    while offset + RECORD.size <= len(data):
+        kind, expires_ts, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            log.warning("snapshot.truncated offset={offset}", offset=offset)
+            return
+        yield kind, expires_ts, offset, offset + length
+        offset += length
+
+
+def write(path: Path, data: bytes):
+    """Atomically replace the snapshot file; readable by the owner only"""
+    tmp = path.with_suffix(".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class UserCacheSnapshots:
+    """Restores a UserCache from disk at startup and snapshots it periodically without blocking the loop"""
+
+    def __init__(self, user_cache: UserCache, path: Path, interval: float = 60):
+        self.user_cache = user_cache
+        self.path = Path(path)
+        self.interval = interval
+        self._saved_version = None
+
+    async def restore(self) -> Tuple[int, int]:
+        """Load the last snapshot, if any; returns (users, sessions) loaded"""
+        try:
+            # Reading and decoding run off the event loop; only indexing touches the cache
+            users, sessions = await asyncio.to_thread(lambda: decode(self.path.read_bytes()))
+        except FileNotFoundError:
+            return 0, 0
+        except (OSError, ValueError) as e:
+            log.warning("snapshot.unreadable path={path} error={error}", path=str(self.path), error=e)
+            return 0, 0
+
+        loaded = self.user_cache.restore(users, sessions)
+        log.info("snapshot.restored users={users} sessions={sessions}", users=loaded[0], sessions=loaded[1])
+        return loaded
+
+    async def save(self) -> bool:
+        """Write a snapshot if the cache changed since the last one"""
+        version = self.user_cache.version
+        if version == self._saved_version:
+            return False
+        # Exporting only copies references; cached user objects are replaced, never mutated, so
+        # encoding and I/O can run off the event loop
+        users, sessions = self.user_cache.export()
+        await asyncio.to_thread(lambda: write(self.path, encode(users, sessions)))
+        self._saved_version = version
+        return True
+
+    async def run(self):
+        """Snapshot every `interval` seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except Exception as e:
+                log.error("snapshot.failed path={path} error={error}", path=str(self.path), error=e)
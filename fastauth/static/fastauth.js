@@ -0,0 +1,28 @@
+// Shared FastAuth page behaviour; served from /static under a content-hashed URL
+(function () {
+    const now = new Date();
+
+    // <span data-now="datetime|time"> is filled with the local render time
+    document.querySelectorAll('[data-now]').forEach(function (el) {
+        el.textContent = el.dataset.now === 'time' ? now.toLocaleTimeString() : now.toLocaleString();
+    });
+
+    // <button data-copy="text" data-copy-message="..."> copies text to the clipboard
+    document.querySelectorAll('[data-copy]').forEach(function (el) {
+        el.addEventListener('click', function () {
+            navigator.clipboard.writeText(el.dataset.copy).then(function () {
+                alert(el.dataset.copyMessage || 'Copied to clipboard!');
+            }, function (err) {
+                console.error('Could not copy text: ', err);
+            });
+        });
+    });
+
+    // <body data-auto-refresh="seconds"> reloads the page periodically
+    const refresh = Number(document.body.dataset.autoRefresh);
+    if (refresh) {
+        setTimeout(function () {
+            location.reload();
+        }, refresh * 1000);
+    }
+})();
@@ -0,0 +1,317 @@
+import base64
+import bisect
+import hashlib
+import itertools
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastauth import events
+from fastauth.oauth_token_manager import AccessToken, tenant_of
+
+# (hard expires_ts, seq, user_id): seq is unique per store, so entries order by expiry then insertion
+IndexEntry = Tuple[float, int, str]
+
+
+def encode_cursor(entry: IndexEntry) -> str:
+    return base64.urlsafe_b64encode(f"{entry[0]!r}:{entry[1]}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    expires_ts, seq = raw.split(":")
+    return float(expires_ts), int(seq)
+
+
+def session_key(session: str) -> str:
+    """Sessions are bearer credentials, so the cache (and its snapshots) only ever hold their digests"""
+    return hashlib.sha256(session.encode()).hexdigest()
+
+
+class UserCache:
+    """In-memory user cache with secondary indexes (email, tenant, expiry order)"""
+
+    def __init__(self, ttl: float = 8 * 3600, session_ttl: float = 8 * 3600, stale_ttl: float = 15 * 60):
+        self.ttl = ttl
+        self.session_ttl = session_ttl
+        # After ttl a user is stale: still served for stale_ttl more while the caller refreshes it
+        self.stale_ttl = stale_ttl
+        self._users: Dict[str, dict] = {}
+        # Keyed by session_key(session), never by the session itself
+        self._sessions: Dict[str, str] = {}
+        self._user_sessions: Dict[str, Set[str]] = {}
+
+        # Indexes. Sorted lists are append-mostly (expiry = now + ttl) and cleaned lazily:
+        # an index entry is live only while _index_keys still maps its user to it.
+        self._seq = itertools.count()
+        self._index_keys: Dict[str, IndexEntry] = {}
+        self._by_expiry: List[IndexEntry] = []
+        self._by_tenant: Dict[str, List[IndexEntry]] = {}
+        self._by_email: Dict[str, Set[str]] = {}
+        self._tenant_counts: Counter = Counter()
+        self._dead_index_entries = 0
+        self._session_expiry: Deque[Tuple[float, str]] = deque()
+        self._session_deadlines: Dict[str, float] = {}
+        self._listeners: List[Callable[[str, str, Optional[str]], None]] = []
+        # Bumped on every change to users or sessions (snapshots skip unchanged caches)
+        self.version = 0
+
+    def add_listener(self, listener: Callable[[str, str, Optional[str]], None]):
+        """Call listener(event_type, user_id, tenant_id) on every store/refresh/expire/remove"""
+        self._listeners.append(listener)
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        """Get cached user object (stale ones included)"""
+        return self.lookup(user_id)[0]
+
+    def lookup(self, user_id: str) -> Tuple[Optional[dict], bool]:
+        """Cached user object and whether it is past its soft expiry and due for a refresh"""
+        key = self._index_keys.get(user_id)
+        if key is None:
+            return None, False
+        now = time.time()
+        if key[0] <= now:
+            return None, False
+        return self._users[user_id], key[0] - self.stale_ttl <= now
+
+    def store_user(self, user_id: str, user_data: dict, microsoft_token: AccessToken):
+        """Cache user object with Microsoft data"""
+        now = time.time()
+        self.purge_expired(now)
+        email = user_data.get("mail") or user_data.get("userPrincipalName", "")
+        tenant_id = user_data.get("tenantId") or tenant_of(user_id) or "common"
+
+        event = events.REFRESH if self._unindex(user_id) else events.STORE
+        self._users[user_id] = {
+            "id": user_id,
+            "email": email,
+            "name": user_data.get("displayName", "Unknown User"),
+            "tenant_id": tenant_id,
+            "profile": user_data,
+            "authenticated": True,
+            "authenticated_at": datetime.utcfromtimestamp(now).isoformat(),
+            "expires_at": datetime.utcfromtimestamp(now + self.ttl).isoformat(),
+            "microsoft_token_expires": microsoft_token.expires_in,
+            # Cache Microsoft data to avoid API calls
+            "cached_profile": user_data,
+            "has_mail_access": microsoft_token.has_scope("Mail.Read"),
+            "has_files_access": microsoft_token.has_scope("Files.Read")
+        }
+        self._index(user_id, now + self.ttl + self.stale_ttl)
+        self._emit(event, user_id, tenant_id)
+
+    def expire_user(self, user_id: str):
+        """Drop the cached user object; bound sessions stay, so the next exchange takes the miss path"""
+        user = self._drop_user(user_id)
+        if user is not None:
+            self._emit(events.EXPIRE, user_id, user["tenant_id"])
+
+    def remove_user(self, user_id: str):
+        """Remove user and every session bound to them from cache"""
+        user = self._drop_user(user_id)
+        sessions = list(self._user_sessions.get(user_id, ()))
+        for session in sessions:
+            self._unbind_session(session)
+        if user is not None or sessions:
+            self._emit(events.REMOVE, user_id, user["tenant_id"] if user else None)
+
+    def bind_session(self, session: str, user_id: str):
+        """Remember which user a browser session signed in as (until session_ttl)"""
+        session = session_key(session)
+        previous = self._unbind_session(session)
+        if previous is not None and previous != user_id:
+            self._signed_out(previous)
+        self._sessions[session] = user_id
+        self._user_sessions.setdefault(user_id, set()).add(session)
+        expires_ts = time.time() + self.session_ttl
+        self._session_deadlines[session] = expires_ts
+        self._session_expiry.append((expires_ts, session))
+        self.version += 1
+
+    def resolve_session(self, session: str) -> Optional[str]:
+        return self._sessions.get(session_key(session))
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Drop users and sessions past their expiry; cost is proportional to what is dropped"""
+        now = now or time.time()
+        cut = bisect.bisect_right(self._by_expiry, (now, float("inf")))
+        if cut:
+            expired = self._by_expiry[:cut]
+            del self._by_expiry[:cut]
+        else:
+            expired = ()
+
+        purged = 0
+        for entry in expired:
+            if self._index_keys.get(entry[2]) == entry:
+                self.expire_user(entry[2])
+                purged += 1
+
+        while self._session_expiry and self._session_expiry[0][0] <= now:
+            expires_ts, session = self._session_expiry.popleft()
+            if self._session_deadlines.get(session) == expires_ts:
+                signed_out = self._unbind_session(session)
+                if signed_out is not None:
+                    self._signed_out(signed_out)
+        return purged
+
+    # --- Snapshots ------------------------------------------------------------------------------
+
+    def export(self) -> Tuple[List[Tuple[float, dict]], List[Tuple[float, str, str]]]:
+        """Live users as (hard expiry, user object) and sessions as (expiry, session key, user id)"""
+        users = [(entry[0], self._users[user_id]) for user_id, entry in self._index_keys.items()]
+        sessions = [(self._session_deadlines[session], session, user_id) for session, user_id in self._sessions.items()]
+        return users, sessions
+
+    def restore(self, users: Iterable[Tuple[float, dict]], sessions: Iterable[Tuple[float, str, str]],
+                now: Optional[float] = None) -> Tuple[int, int]:
+        """Load exported entries, skipping expired ones and anything already cached; returns counts loaded"""
+        now = now or time.time()
+        # Index in expiry order, then merge into the sorted lists once instead of an insort per user
+        entries = []
+        for expires_ts, user in sorted(users, key=lambda item: item[0]):
+            if expires_ts > now and user["id"] not in self._index_keys:
+                self._users[user["id"]] = user
+                entries.append(self._index_lookups(user["id"], expires_ts))
+
+        if entries:
+            self._by_expiry += entries
+            self._by_expiry.sort()  # two sorted runs: a linear merge
+            touched = set()
+            for entry in entries:
+                tenant_id = self._users[entry[2]]["tenant_id"]
+                self._by_tenant.setdefault(tenant_id, []).append(entry)
+                touched.add(tenant_id)
+            for tenant_id in touched:
+                self._by_tenant[tenant_id].sort()
+        loaded_users = len(entries)
+        loaded_sessions = 0
+
+        for expires_ts, session, user_id in sessions:
+            if expires_ts > now and session not in self._sessions:
+                self._sessions[session] = user_id
+                self._user_sessions.setdefault(user_id, set()).add(session)
+                self._session_deadlines[session] = expires_ts
+                self._session_expiry.append((expires_ts, session))
+                loaded_sessions += 1
+        self._session_expiry = deque(sorted(self._session_expiry))
+        return loaded_users, loaded_sessions
+
+    # --- Queries --------------------------------------------------------------------------------
+
+    def count_users(self, tenant: Optional[str] = None, email: Optional[str] = None) -> int:
+        """Number of live cached users matching the filters, without materializing them"""
+        self.purge_expired()
+        if email is not None:
+            return sum(1 for _ in self._email_matches(email, tenant))
+        if tenant is not None:
+            return self._tenant_counts.get(tenant, 0)
+        return len(self._users)
+
+    def list_users(self, cursor: Optional[str] = None, limit: int = 100, tenant: Optional[str] = None,
+                   email: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """One page of users in expiry order; returns (users, next_cursor)"""
+        self.purge_expired()
+        after = decode_cursor(cursor) if cursor else None
+
+        if email is not None:
+            entries = iter(sorted(self._index_keys[uid] for uid in self._email_matches(email, tenant)))
+            if after:
+                entries = (e for e in entries if (e[0], e[1]) > after)
+        else:
+            index = self._by_expiry if tenant is None else self._by_tenant.get(tenant, [])
+            start = bisect.bisect_left(index, (after[0], after[1] + 1)) if after else 0
+            entries = (e for e in itertools.islice(index, start, None) if self._index_keys.get(e[2]) == e)
+
+        page = list(itertools.islice(entries, limit + 1))
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return [self._users[e[2]] for e in page[:limit]], next_cursor
+
+    def find_by_email(self, email: str) -> List[dict]:
+        return [self._users[uid] for uid in self._email_matches(email)]
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    # --- Index maintenance ----------------------------------------------------------------------
+
+    def _email_matches(self, email: str, tenant: Optional[str] = None) -> Iterable[str]:
+        for user_id in self._by_email.get(email.casefold(), ()):
+            if tenant is None or self._users[user_id]["tenant_id"] == tenant:
+                yield user_id
+
+    def _index(self, user_id: str, expires_ts: float):
+        entry = self._index_lookups(user_id, expires_ts)
+        bisect.insort(self._by_expiry, entry)
+        bisect.insort(self._by_tenant.setdefault(self._users[user_id]["tenant_id"], []), entry)
+
+    def _index_lookups(self, user_id: str, expires_ts: float) -> IndexEntry:
+        """Index a user everywhere except the sorted lists; returns the user's index entry"""
+        user = self._users[user_id]
+        entry = (expires_ts, next(self._seq), user_id)
+        self._index_keys[user_id] = entry
+        self._tenant_counts[user["tenant_id"]] += 1
+        if user["email"]:
+            self._by_email.setdefault(user["email"].casefold(), set()).add(user_id)
+        return entry
+
+    def _emit(self, event: str, user_id: str, tenant_id: Optional[str]):
+        self.version += 1
+        for listener in self._listeners:
+            listener(event, user_id, tenant_id)
+
+    def _drop_user(self, user_id: str) -> Optional[dict]:
+        self._unindex(user_id)
+        return self._users.pop(user_id, None)
+
+    def _unindex(self, user_id: str) -> bool:
+        entry = self._index_keys.pop(user_id, None)
+        if entry is None:
+            return False
+
+        user = self._users[user_id]
+        self._tenant_counts[user["tenant_id"]] -= 1
+        if not self._tenant_counts[user["tenant_id"]]:
+            del self._tenant_counts[user["tenant_id"]]
+        emails = self._by_email.get(user["email"].casefold())
+        if emails is not None:
+            emails.discard(user_id)
+            if not emails:
+                del self._by_email[user["email"].casefold()]
+
+        # Sorted-list entries are left behind as dead weight and compacted in bulk
+        self._dead_index_entries += 1
+        if self._dead_index_entries > max(1024, len(self._index_keys)):
+            self._compact()
+        return True
+
+    def _compact(self):
+        live = self._index_keys
+        self._by_expiry = [e for e in self._by_expiry if live.get(e[2]) == e]
+        self._by_tenant = {
+            tenant: kept for tenant, entries in self._by_tenant.items()
+            if (kept := [e for e in entries if live.get(e[2]) == e])
+        }
+        self._dead_index_entries = 0
+
+    def _signed_out(self, user_id: str):
+        # Their last session ended: nothing can reach the user anymore, so REMOVE (even if the
+        # cached object already expired) lets listeners drop what they hold, e.g. tokens
+        user = self._drop_user(user_id)
+        self._emit(events.REMOVE, user_id, user["tenant_id"] if user else tenant_of(user_id))
+
+    def _unbind_session(self, session: str) -> Optional[str]:
+        """Forget a session; returns its user if it was their last one"""
+        self._session_deadlines.pop(session, None)
+        user_id = self._sessions.pop(session, None)
+        if user_id is None:
+            return None
+        self.version += 1
+        sessions = self._user_sessions.get(user_id)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self._user_sessions[user_id]
+                return user_id
+        return None
@@ -0,0 +1,17 @@
+import pytest
+
+from benchmarks.stubs import StubIdentityProvider, StubServer
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="module")
+def idp():
+    """Local identity provider serving discovery, JWKS and signed id_tokens"""
+    app = StubIdentityProvider()
+    server = StubServer(app).start()
+    yield app, server.url
+    server.stop()
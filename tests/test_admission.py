@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from fastauth.admission import AdmissionController, Overloaded
+
+pytestmark = pytest.mark.anyio
+
+
+async def hold(controller: AdmissionController, release: asyncio.Event):
+    async with controller.admit():
+        await release.wait()
+
+
+async def test_admits_up_to_max_concurrent():
+    controller = AdmissionController(max_concurrent=2, max_queue=0)
+    release = asyncio.Event()
+    holders = [asyncio.create_task(hold(controller, release)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert controller.active == 2
+
+    with pytest.raises(Overloaded) as shed:
+        async with controller.admit():
+            pass
+    assert shed.value.retry_after == controller.retry_after
+    assert controller.stats.shed_queue_full == 1
+
+    release.set()
+    await asyncio.gather(*holders)
+    assert controller.active == 0
+    assert controller.stats.admitted == 2
+
+
+async def test_queued_request_gets_a_freed_slot():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(controller, release))
+    await asyncio.sleep(0)
+
+    waiter = asyncio.create_task(hold(controller, asyncio.Event()))
+    await asyncio.sleep(0)
+    assert controller.waiting == 1
+
+    release.set()
+    await holder
+    await asyncio.sleep(0.01)  # wait_for needs a few loop turns to hand over the slot
+    assert controller.active == 1 and controller.waiting == 0
+    assert controller.stats.queued == 1
+    waiter.cancel()
+
+
+async def test_queue_timeout_sheds():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.01)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(controller, release))
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded):
+        async with controller.admit():
+            pass
+    assert controller.stats.shed_timeout == 1
+    assert controller.waiting == 0
+
+    release.set()
+    await holder
+
+
+async def test_try_admit_never_queues():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=1)
+    async with controller.try_admit():
+        assert controller.active == 1
+        with pytest.raises(Overloaded):
+            async with controller.try_admit():
+                pass
+    assert controller.stats.skipped_busy == 1
+    assert controller.stats.queued == 0
+    assert controller.active == 0
+
+
+async def test_try_admit_yields_to_queued_requests():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=1)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(controller, release))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold(controller, release))
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded):
+        async with controller.try_admit():
+            pass
+    assert controller.waiting == 1
+
+    release.set()
+    await asyncio.gather(holder, waiter)
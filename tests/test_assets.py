@@ -0,0 +1,94 @@
+import gzip
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastauth.core import AuthServer
+from fastauth.manifest import AppManifest
+from fastauth.server import AuthCallbackServer, get_static_assets
+
+ASSET = "fastauth.css"
+
+
+@pytest.fixture
+def client(tmp_path):
+    return TestClient(AuthCallbackServer(AuthServer(tmp_path, AppManifest("test-client"))))
+
+
+@pytest.fixture
+def asset():
+    return get_static_assets()._by_name[ASSET]
+
+
+def hashed_url() -> str:
+    return get_static_assets().url(ASSET)
+
+
+def test_hashed_name_is_immutable(client, asset):
+    response = client.get(hashed_url(), headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.content == asset.body
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert response.headers["ETag"] == f'"{asset.digest}"'
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in response.headers
+
+
+def test_plain_name_revalidates(client):
+    response = client.get(f"/static/{ASSET}")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, no-cache"
+
+
+def test_unknown_asset(client):
+    assert client.get("/static/missing.css").status_code == 404
+
+
+def test_gzip_variant(client, asset):
+    assert asset.gzip is not None
+    response = client.get(hashed_url(), headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == f'"{asset.digest}-gzip"'
+    assert response.content == asset.body  # decoded by the client
+    assert gzip.decompress(asset.gzip) == asset.body
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip;q=0", "gzip; q=0.0, identity", "identity", ""])
+def test_refused_or_missing_encodings_get_identity(client, accept_encoding):
+    response = client.get(hashed_url(), headers={"Accept-Encoding": accept_encoding})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_brotli_preferred_when_available(client, asset, monkeypatch):
+    monkeypatch.setattr(asset, "br", b"br-bytes")
+    response = client.get(hashed_url(), headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.headers["ETag"] == f'"{asset.digest}-br"'
+
+    response = client.get(hashed_url(), headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+@pytest.mark.parametrize("if_none_match", ['"{digest}"', '"{digest}-gzip"', 'W/"{digest}-br"', '"other", "{digest}"', "*"])
+def test_if_none_match_returns_304(client, asset, if_none_match):
+    response = client.get(hashed_url(), headers={"If-None-Match": if_none_match.format(digest=asset.digest)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"]
+
+
+def test_stale_etag_gets_the_body(client, asset):
+    response = client.get(hashed_url(), headers={"If-None-Match": '"000000000000"'})
+    assert response.status_code == 200
+    assert response.content == asset.body
+
+
+def test_head_reports_length_of_the_negotiated_variant(client, asset):
+    response = client.head(hashed_url(), headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["Content-Length"] == str(len(asset.gzip))
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    response = client.head(hashed_url(), headers={"Accept-Encoding": "identity"})
+    assert response.headers["Content-Length"] == str(len(asset.body))
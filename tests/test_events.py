@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from fastauth import events
+from fastauth.events import ChangeFeed
+
+pytestmark = pytest.mark.anyio
+
+
+def test_since_replays_within_epoch():
+    feed = ChangeFeed()
+    first = feed.publish(events.STORE, "t:a", "t")
+    feed.publish(events.REFRESH, "t:a", "t")
+    feed.publish(events.REMOVE, "t:a", "t")
+    assert [e.type for e in feed.since(first.id)] == [events.REFRESH, events.REMOVE]
+    assert feed.since(feed.last_event_id) == []
+
+
+def test_since_after_restart_needs_reset():
+    old = ChangeFeed()
+    old.publish(events.REMOVE, "t:a", "t")
+    last_seen = old.last_event_id
+
+    new = ChangeFeed()
+    for i in range(5):
+        new.publish(events.STORE, f"t:{i}", "t")
+    # The new process is past the old seq, but its events don't continue the old stream
+    assert new.since(last_seen) is None
+
+
+@pytest.mark.parametrize("event_id", ["3", "", "abc", "-1", "x-y"])
+def test_since_malformed_ids(event_id):
+    feed = ChangeFeed()
+    for i in range(5):
+        feed.publish(events.STORE, f"t:{i}", "t")
+    assert feed.since(event_id) is None
+
+
+def test_since_gap_after_buffer_rolls_over():
+    feed = ChangeFeed(capacity=3)
+    first = feed.publish(events.STORE, "t:0", "t")
+    for i in range(1, 5):
+        feed.publish(events.STORE, f"t:{i}", "t")
+    assert feed.since(first.id) is None
+
+
+async def test_subscribe_sends_reset_for_foreign_epoch():
+    feed = ChangeFeed()
+    stream = feed.subscribe(since="deadbeef-1")
+    reset = await stream.__anext__()
+    assert reset.type == events.RESET
+    assert reset.id == feed.last_event_id
+
+    feed.publish(events.STORE, "t:a", "t")
+    assert (await stream.__anext__()).user_id == "t:a"
+    await stream.aclose()
+
+
+async def test_slow_subscriber_is_cut_off():
+    feed = ChangeFeed(subscriber_buffer=2)
+    stream = feed.subscribe()
+    pending = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)  # subscribed once the generator starts
+    feed.publish(events.STORE, "t:0", "t")
+    first = await pending
+    for i in range(1, 5):
+        feed.publish(events.STORE, f"t:{i}", "t")
+    assert first.user_id == "t:0"
+    with pytest.raises(StopAsyncIteration):
+        await stream.__anext__()
+    assert len(feed) == 0
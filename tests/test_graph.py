@@ -0,0 +1,45 @@
+import pytest
+
+from fastauth.oauth_token_manager import FULL_PROFILE, GraphAPI, GraphQuery
+
+
+def test_params():
+    query = GraphQuery(select=("id", "subject"), filter="isRead eq false", orderby=("subject",), top=5)
+    assert query.params() == {
+        "$select": "id,subject",
+        "$filter": "isRead eq false",
+        "$orderby": "subject",
+        "$top": "5",
+    }
+
+
+def test_caller_options_replace_defaults():
+    query = GraphAPI().query_for("emails", GraphQuery(select=("id",), top=3))
+    assert query.select == ("id",)
+    assert query.top == 3
+    assert query.orderby == ("receivedDateTime desc",)
+
+
+def test_clear_drops_defaults():
+    query = GraphAPI().query_for("emails", GraphQuery(clear=("select", "top")))
+    assert "$select" not in query.params()
+    assert "$top" not in query.params()
+    assert query.params()["$orderby"] == "receivedDateTime desc"
+
+
+def test_full_profile_has_no_select():
+    assert GraphAPI().query_for("profile", FULL_PROFILE).params() == {}
+
+
+def test_filter_drops_default_orderby():
+    query = GraphAPI().query_for("emails", GraphQuery(filter="isRead eq false"))
+    assert "$orderby" not in query.params()
+
+    ordered = GraphAPI().query_for("emails", GraphQuery(filter="receivedDateTime ge 2024-01-01",
+                                                        orderby=("receivedDateTime desc",)))
+    assert ordered.params()["$orderby"] == "receivedDateTime desc"
+
+
+def test_unknown_clear_option():
+    with pytest.raises(ValueError):
+        GraphQuery(clear=("selct",))
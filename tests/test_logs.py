@@ -0,0 +1,21 @@
+from loguru import logger
+
+from fastauth.logs import configure_logging, log
+
+
+def test_configure_logging_owns_only_its_sink():
+    app_records, ours = [], []
+    app_handler = logger.add(app_records.append, level="DEBUG", format="{message}")
+    try:
+        configure_logging("DEBUG", sink=ours.append, enqueue=False)
+        configure_logging("INFO", sink=ours.append, enqueue=False)  # replaces its own sink, once
+
+        log.debug("fastauth.debug")
+        log.info("fastauth.info")
+        logger.info("app.info")
+
+        # INFO floor, FastAuth records only; the application's handler still gets everything
+        assert len(ours) == 1 and "fastauth.info" in ours[0]
+        assert any("app.info" in record for record in app_records)
+    finally:
+        logger.remove(app_handler)
@@ -0,0 +1,102 @@
+import time
+
+import jwt
+import pytest
+
+from benchmarks.stubs import STUB_TENANT_ID
+from fastauth.oidc import IdTokenValidator, OpenIDMetadataCache
+
+pytestmark = pytest.mark.anyio
+
+CLIENT_ID = "test-client"
+
+
+def claims(url: str, **overrides) -> dict:
+    now = int(time.time())
+    return {
+        "iss": f"{url}/{STUB_TENANT_ID}/v2.0",
+        "aud": CLIENT_ID,
+        "iat": now,
+        "exp": now + 3600,
+        "oid": "id-alice",
+        "tid": STUB_TENANT_ID,
+        **overrides,
+    }
+
+
+def validator(url: str, **cache_options) -> IdTokenValidator:
+    return IdTokenValidator(CLIENT_ID, OpenIDMetadataCache(url, **cache_options), leeway=0)
+
+
+async def test_valid_token(idp):
+    app, url = idp
+    result = await validator(url).validate(app.signing_keys.sign(claims(url)))
+    assert result["oid"] == "id-alice"
+    assert result["tid"] == STUB_TENANT_ID
+
+
+async def test_wrong_audience(idp):
+    app, url = idp
+    with pytest.raises(jwt.InvalidAudienceError):
+        await validator(url).validate(app.signing_keys.sign(claims(url, aud="someone-else")))
+
+
+async def test_issuer_must_match_tid(idp):
+    app, url = idp
+    token = app.signing_keys.sign(claims(url, iss=f"{url}/11111111-1111-1111-1111-111111111111/v2.0"))
+    with pytest.raises(jwt.InvalidIssuerError):
+        await validator(url).validate(token)
+
+
+async def test_foreign_issuer(idp):
+    app, url = idp
+    with pytest.raises(jwt.InvalidIssuerError):
+        await validator(url).validate(app.signing_keys.sign(claims(url, iss=f"https://evil.test/{STUB_TENANT_ID}/v2.0")))
+
+
+async def test_expired_token(idp):
+    app, url = idp
+    token = app.signing_keys.sign(claims(url, iat=int(time.time()) - 7200, exp=int(time.time()) - 3600))
+    with pytest.raises(jwt.ExpiredSignatureError):
+        await validator(url).validate(token)
+
+
+async def test_unsigned_token_rejected(idp):
+    app, url = idp
+    token = jwt.encode(claims(url), key=None, algorithm="none")
+    with pytest.raises(jwt.InvalidAlgorithmError):
+        await validator(url).validate(token)
+
+
+async def test_rotated_kid_refetches_jwks(idp):
+    app, url = idp
+    checker = validator(url, min_refresh_interval=0)
+    await checker.validate(app.signing_keys.sign(claims(url)))
+    fetches = app.stats["jwks"]
+
+    app.signing_keys.rotate()
+    result = await checker.validate(app.signing_keys.sign(claims(url)))
+    assert result["oid"] == "id-alice"
+    assert app.stats["jwks"] == fetches + 1
+
+
+async def test_unknown_kid_refetch_is_rate_limited(idp):
+    app, url = idp
+    checker = validator(url, min_refresh_interval=300)
+    await checker.validate(app.signing_keys.sign(claims(url)))
+    fetches = app.stats["jwks"]
+
+    app.signing_keys.rotate()
+    with pytest.raises(jwt.InvalidTokenError):
+        await checker.validate(app.signing_keys.sign(claims(url)))
+    assert app.stats["jwks"] == fetches
+
+
+async def test_failed_refresh_keeps_cached_keys(idp):
+    app, url = idp
+    checker = validator(url)
+    await checker.validate(app.signing_keys.sign(claims(url)))
+
+    checker.metadata.authority = "http://127.0.0.1:9"  # nothing listening
+    await checker.metadata.refresh("common", force=True)
+    assert (await checker.validate(app.signing_keys.sign(claims(url))))["oid"] == "id-alice"
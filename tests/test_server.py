@@ -0,0 +1,226 @@
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import asyncio
+import time
+from functools import partial
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import fastauth.server
+from fastauth.admission import AdmissionController
+from fastauth.core import AuthServer
+from fastauth.manifest import AppManifest
+from fastauth.oauth_token_manager import AccessToken
+from fastauth.middleware import add_oauth
+from fastauth.server import AuthCallbackServer
+
+
+@pytest.fixture
+def exchange_admission():
+    return None  # server default; parametrize to override
+
+
+@pytest.fixture
+def app(tmp_path: Path, idp, exchange_admission):
+    _, idp_url = idp
+    AuthServer._oauth_client = None  # shared across AuthServer instances
+    # Fresh process-wide cache and feed, so the server's listeners are on the cache it serves from
+    fastauth.server._user_cache = fastauth.server._change_feed = None
+    manifest = AppManifest("test-client", redirect_uri="http://testserver/callback", authority=idp_url)
+    app = AuthCallbackServer(AuthServer(tmp_path, manifest), exchange_admission=exchange_admission)
+    yield app
+    AuthServer._oauth_client = None
+    fastauth.server._user_cache = fastauth.server._change_feed = None
+
+
+@pytest.fixture
+def client(app):
+    with TestClient(app, follow_redirects=False) as client:
+        yield client
+
+
+def cache_user(app, user_id: str = "tid1:oid1"):
+    token = AccessToken("at", "Bearer", 3600, "User.Read")
+    app.user_cache.store_user(user_id, {"displayName": "Victim", "mail": "victim@contoso.test"}, token)
+
+
+def as_session(client: TestClient, session: str = None) -> dict:
+    """Headers for a request from one browser session only (nothing the client picked up earlier)"""
+    client.cookies.clear()
+    return {"Cookie": f"session={session}"} if session else {}
+
+
+def start_login(client: TestClient, session: str = None) -> str:
+    """GET / (as `session`, or letting the server hand one out); returns the flow's state"""
+    response = client.get("/", headers=as_session(client, session))
+    assert response.status_code == 307
+    return parse_qs(urlparse(response.headers["location"]).query)["state"][0]
+
+
+def test_exchange_bound_session(app, client):
+    cache_user(app)
+    app.user_cache.bind_session("session-1", "tid1:oid1")
+    response = client.post("/api/exchange", json={"session_token": "session-1"})
+    assert response.status_code == 200
+    assert response.json()["id"] == "tid1:oid1"
+
+
+def test_exchange_rejects_user_key_as_session(app, client):
+    cache_user(app)
+    response = client.post("/api/exchange", json={"session_token": "tid1:oid1"})
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/"
+
+
+def test_exchange_rejects_unsigned_jwt_session(app, client):
+    import jwt
+    cache_user(app)
+    forged = jwt.encode({"sub": "tid1:oid1", "user_id": "tid1:oid1"}, key=None, algorithm="none")
+    response = client.post("/api/exchange", json={"session_token": forged})
+    assert response.status_code == 302
+
+
+def test_lifespan_starts_and_stops_background_tasks(app):
+    with TestClient(app):
+        assert len(app._background_tasks) == 1
+    assert all(task.cancelled() or task.done() for task in app._background_tasks)
+
+
+def test_login_binds_the_session_that_started_it(app, client):
+    state = start_login(client, "alice-session")
+    response = client.get("/callback", params={"code": "code.alice.1", "state": state},
+                          headers=as_session(client, "alice-session"))
+    assert response.status_code == 307
+    user_id = app.user_cache.resolve_session("alice-session")
+    assert user_id and user_id.endswith(":id-alice")
+
+
+def test_login_hands_out_a_session_cookie(app, client):
+    response = client.get("/", headers=as_session(client))
+    session = response.cookies["session"]
+    state = parse_qs(urlparse(response.headers["location"]).query)["state"][0]
+    client.get("/callback", params={"code": "code.bob.1", "state": state}, headers=as_session(client, session))
+    assert app.user_cache.resolve_session(session).endswith(":id-bob")
+
+
+@pytest.mark.parametrize("victim_session", ["victim-session", None])
+def test_callback_rejects_state_from_another_session(app, client, victim_session):
+    state = start_login(client, "attacker-session")
+    response = client.get("/callback", params={"code": "code.attacker.1", "state": state},
+                          headers=as_session(client, victim_session))
+    assert response.status_code == 403
+    assert app.user_cache.resolve_session("victim-session") is None
+    assert len(app.user_cache) == 0
+
+    # The replayed state is spent; the attacker can't finish it either
+    response = client.get("/callback", params={"code": "code.attacker.1", "state": state},
+                          headers=as_session(client, "attacker-session"))
+    assert app.user_cache.resolve_session("attacker-session") is None
+
+
+def test_tokens_dropped_when_last_session_expires(app, client):
+    state = start_login(client, "alice-session")
+    client.get("/callback", params={"code": "code.alice.1", "state": state}, headers=as_session(client, "alice-session"))
+    user_id = app.user_cache.resolve_session("alice-session")
+    token_storage = AuthServer._oauth_client.token_storage
+    assert len(token_storage) == 1
+
+    async def purge_sessions():
+        app.user_cache.purge_expired(now=time.time() + app.user_cache.session_ttl + 1)
+        await asyncio.sleep(0.01)
+
+    client.portal.call(purge_sessions)
+    assert app.user_cache.resolve_session("alice-session") is None
+    assert app.user_cache.get_user(user_id) is None
+    assert len(token_storage) == 0
+
+
+@pytest.mark.parametrize("exchange_admission", [AdmissionController("exchange", max_concurrent=1, max_queue=0)])
+def test_exchange_sheds_misses_but_serves_hits_when_full(app, client, exchange_admission, monkeypatch):
+    cache_user(app)
+    app.user_cache.bind_session("hit-session", "tid1:oid1")
+    app.user_cache.bind_session("miss-session", "tid1:oid2")  # bound but not cached: the miss path
+
+    # Downstream app whose middleware reaches the auth server in-process
+    downstream = FastAPI()
+    add_oauth(downstream, oauth_url="http://testserver")
+    monkeypatch.setattr(httpx, "AsyncClient", partial(httpx.AsyncClient, transport=httpx.ASGITransport(app)))
+
+    @downstream.get("/")
+    async def home(request: Request):
+        return {"user": request.state.user["id"]}
+
+    release = asyncio.Event()
+
+    async def occupy():
+        async with exchange_admission.admit():
+            await release.wait()
+
+    occupied = client.portal.start_task_soon(occupy)
+    client.portal.call(asyncio.sleep, 0.01)
+    assert exchange_admission.active == 1
+    try:
+        response = client.post("/api/exchange", json={"session_token": "miss-session"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+        response = client.post("/api/exchange", json={"session_token": "hit-session"})
+        assert response.status_code == 200
+
+        with TestClient(downstream, follow_redirects=False) as browser:
+            response = browser.get("/", headers=as_session(browser, "miss-session"))
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+
+            response = browser.get("/", headers=as_session(browser, "hit-session"))
+            assert response.json() == {"user": "tid1:oid1"}
+    finally:
+        client.portal.call(release.set)
+        occupied.result(timeout=1)
+
+    # Misses were shed without queueing; hits never touched the controller
+    assert exchange_admission.stats.shed_queue_full == 2
+    assert exchange_admission.stats.admitted == 1
+
+
+def test_stale_user_is_served_while_one_refresh_runs(app, client, idp, monkeypatch):
+    idp_app, _ = idp
+    monkeypatch.setattr(idp_app.config, "latency", 0.2)  # keeps the refresh in flight across requests
+    app.user_cache.ttl = 0  # users are stale as soon as they are stored
+    state = start_login(client, "alice-session")
+    client.get("/callback", params={"code": "code.alice.1", "state": state}, headers=as_session(client, "alice-session"))
+    user_id = app.user_cache.resolve_session("alice-session")
+    for token in client.portal.call(AuthServer._oauth_client.token_storage.get_tokens, user_id):
+        token.issued_at -= token.expires_in  # revalidating has to refresh it
+    refreshes = idp_app.stats["refresh"]
+
+    for _ in range(2):
+        response = client.post("/api/exchange", json={"session_token": "alice-session"})
+        assert response.status_code == 200
+        assert response.json()["id"] == user_id
+    assert list(app._revalidations) == [user_id]
+
+    app.user_cache.ttl = 3600
+    client.portal.call(asyncio.wait, list(app._revalidations.values()))
+    assert idp_app.stats["refresh"] == refreshes + 1
+    cached_user, stale = app.user_cache.lookup(user_id)
+    assert cached_user and not stale
+
+
+def test_stale_user_without_token_hard_expires(app, client):
+    app.user_cache.ttl = 0
+    cache_user(app)  # cached, but no token to refresh with
+    app.user_cache.bind_session("session-1", "tid1:oid1")
+
+    response = client.post("/api/exchange", json={"session_token": "session-1"})
+    assert response.status_code == 200
+    client.portal.call(asyncio.sleep, 0.05)
+    assert not app._revalidations
+    assert app.user_cache.get_user("tid1:oid1") is None
+
+    response = client.post("/api/exchange", json={"session_token": "session-1"})
+    assert response.status_code == 302
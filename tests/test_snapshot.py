@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from fastauth import snapshot
+from fastauth.oauth_token_manager import AccessToken
+from fastauth.snapshot import UserCacheSnapshots
+from fastauth.user_cache import UserCache
+
+pytestmark = pytest.mark.anyio
+
+TOKEN = AccessToken("at", "Bearer", 3600, "User.Read")
+
+
+def filled_cache(users: int = 5) -> UserCache:
+    cache = UserCache()
+    for i in range(users):
+        cache.store_user(f"t{i % 2}:u{i}", {"mail": f"u{i}@contoso.test", "displayName": f"U{i}"}, TOKEN)
+        cache.bind_session(f"session-{i}", f"t{i % 2}:u{i}")
+    return cache
+
+
+def test_round_trip():
+    users, sessions = filled_cache().export()
+    decoded_users, decoded_sessions = snapshot.decode(snapshot.encode(users, sessions))
+    assert [(e, u) for e, u in decoded_users] == users
+    assert decoded_sessions == sessions
+
+
+def test_decode_skips_expired_and_truncated_tail():
+    now = time.time()
+    users = [(now - 1, {"id": "t:old", "profile": {}}), (now + 60, {"id": "t:new", "profile": {}})]
+    data = snapshot.encode(users, [(now + 60, "key", "t:new")])
+    decoded_users, decoded_sessions = snapshot.decode(data[:-3], now)
+    assert [u["id"] for _, u in decoded_users] == ["t:new"]
+    assert decoded_sessions == []
+
+
+def test_rejects_other_files():
+    with pytest.raises(ValueError):
+        snapshot.decode(b"{}")
+
+
+async def test_save_and_restore(tmp_path):
+    path = tmp_path / snapshot.FILENAME
+    assert await UserCacheSnapshots(filled_cache(), path).save()
+    assert b"session-1" not in path.read_bytes()
+    assert path.stat().st_mode & 0o077 == 0
+
+    restored = UserCache()
+    assert await UserCacheSnapshots(restored, path).restore() == (5, 5)
+    assert restored.resolve_session("session-3") == "t1:u3"
+    assert restored.count_users(tenant="t0") == 3
+    page, _ = restored.list_users(limit=10)
+    assert len(page) == 5
+
+
+async def test_save_skips_unchanged_cache(tmp_path):
+    snapshots = UserCacheSnapshots(filled_cache(), tmp_path / snapshot.FILENAME)
+    assert await snapshots.save()
+    assert not await snapshots.save()
+
+
+def test_restore_keeps_index_order():
+    source = filled_cache(50)
+    users, sessions = source.export()
+    target = UserCache()
+    target.store_user("t0:live", {"mail": "live@contoso.test"}, TOKEN)
+    target.restore(reversed(users), sessions)
+    assert target._by_expiry == sorted(target._by_expiry)
+    assert all(entries == sorted(entries) for entries in target._by_tenant.values())
+    assert len(target) == 51
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from fastauth.admission import Overloaded
+from fastauth.oauth_token_manager import MultiTenantTokenManager, PKCEChallenge
+from fastauth.oidc import OpenIDMetadataCache
+from fastauth.server import AuthUrlBuilder
+
+pytestmark = pytest.mark.anyio
+
+DEAD_AUTHORITY = "http://127.0.0.1:9"  # nothing listening
+
+
+def manager(authority: str, max_pools: int = 2, **metadata_options) -> MultiTenantTokenManager:
+    tokens = MultiTenantTokenManager("test-client", authority=authority,
+                                     metadata=OpenIDMetadataCache(authority, **metadata_options))
+    tokens.MAX_TENANT_POOLS = max_pools
+    return tokens
+
+
+async def test_refresh_goes_to_the_users_tenant(idp):
+    app, url = idp
+    tokens = manager(url)
+    try:
+        await tokens.refresh_token("rt.alice.1", "User.Read", tenant="contoso.test")
+        assert await tokens.token_endpoint_for("contoso.test") == f"{url}/contoso.test/oauth2/v2.0/token"
+        assert list(tokens._pools) == ["contoso.test"]
+    finally:
+        await tokens.close()
+
+
+async def test_single_tenant_apps_stay_pinned(idp):
+    _, url = idp
+    tokens = MultiTenantTokenManager("test-client", authority=url, tenant="fabrikam.test")
+    assert tokens.route_tenant("contoso.test") == "fabrikam.test"
+    assert tokens.create_pkce_challenge("state", "contoso.test").tenant == "fabrikam.test"
+
+
+async def test_tenant_pools_are_lru_bounded(idp):
+    _, url = idp
+    tokens = manager(url, max_pools=2)
+    try:
+        for i in range(5):
+            await tokens.refresh_token("rt.alice.1", "User.Read", tenant=f"tenant{i}.test")
+        assert list(tokens._pools) == ["tenant3.test", "tenant4.test"]
+    finally:
+        await tokens.close()
+
+
+async def test_undiscoverable_tenants_share_one_pool():
+    tokens = manager(DEAD_AUTHORITY, max_pools=2)
+    try:
+        for i in range(5):
+            with pytest.raises(Exception):
+                await tokens.refresh_token("rt.alice.1", "User.Read", tenant=f"made-up{i}")
+        assert not tokens._pools
+        assert tokens._shared_pool is not None
+        assert len(tokens._fallbacks) == 2
+        assert not tokens.metadata._locks
+    finally:
+        await tokens.close()
+
+
+async def test_metadata_cache_is_bounded(idp):
+    _, url = idp
+    metadata = OpenIDMetadataCache(url, max_tenants=2)
+    for i in range(4):
+        await metadata.get_metadata(f"tenant{i}.test")
+    assert list(metadata._fetched_at) == ["tenant2.test", "tenant3.test"]
+    assert set(metadata._metadata) == set(metadata._keys) == {"tenant2.test", "tenant3.test"}
+
+
+async def test_saturated_tenant_is_shed_fast(idp, monkeypatch):
+    app, url = idp
+    monkeypatch.setattr(app.config, "latency", 0.3)
+    tokens = MultiTenantTokenManager("test-client", authority=url, metadata=OpenIDMetadataCache(url),
+                                     max_concurrent_per_tenant=1)
+    try:
+        await tokens.metadata.get_metadata("slow.test")
+        slow = asyncio.ensure_future(tokens.refresh_token("rt.alice.1", "User.Read", tenant="slow.test"))
+        await asyncio.sleep(0.05)
+
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(Overloaded):
+            await tokens.refresh_token("rt.bob.1", "User.Read", tenant="slow.test")
+        assert asyncio.get_running_loop().time() - started < 0.1
+        await tokens.refresh_token("rt.carol.1", "User.Read", tenant="other.test")  # other tenants unaffected
+        await slow
+        assert tokens._pools["slow.test"].session.timeout.total == tokens.REQUEST_TIMEOUT.total
+    finally:
+        await tokens.close()
+
+
+async def test_authorize_url_comes_from_discovery(idp):
+    _, url = idp
+    builder = AuthUrlBuilder("test-client", authority=DEAD_AUTHORITY, metadata=OpenIDMetadataCache(url))
+    auth_url = await builder.build_auth_url("User.Read", PKCEChallenge.generate(), "state", tenant="contoso.test")
+    assert auth_url.startswith(f"{url}/contoso.test/oauth2/v2.0/authorize?")
+
+    fallback = AuthUrlBuilder("test-client", authority=url, metadata=OpenIDMetadataCache(DEAD_AUTHORITY))
+    assert await fallback.endpoint_for("contoso.test") == f"{url}/contoso.test/oauth2/v2.0/authorize"
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from fastauth.oauth_token_manager import (
+    AccessToken,
+    GRAPH_RESOURCE,
+    TokenStorage,
+    parse_scopes,
+    resource_of,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def token(scope: str, access_token: str = "at", issued_at: float = None, expires_in: int = 3600) -> AccessToken:
+    return AccessToken(access_token, "Bearer", expires_in, scope, refresh_token=f"rt-{access_token}",
+                       issued_at=issued_at)
+
+
+def test_parse_scopes_normalizes_graph_prefix_and_case():
+    assert parse_scopes("https://graph.microsoft.com/User.Read mail.read") == {"user.read", "mail.read"}
+
+
+def test_resource_of():
+    assert resource_of(parse_scopes("openid User.Read")) == GRAPH_RESOURCE
+    assert resource_of(parse_scopes("api://app/Read api://app/Write")) == "api://app"
+    with pytest.raises(ValueError):
+        resource_of(parse_scopes("User.Read api://app/Read"))
+
+
+def test_covers_ignores_sign_in_scopes():
+    granted = token("User.Read Mail.Read")
+    assert granted.covers(parse_scopes("openid offline_access User.Read"))
+    assert not granted.covers(parse_scopes("Files.Read"))
+    assert granted.has_scope("https://graph.microsoft.com/Mail.Read")
+
+
+async def test_storage_returns_covering_token():
+    storage = TokenStorage()
+    await storage.store_token("t:u", token("User.Read", "narrow"))
+    await storage.store_token("t:u", token("api://app/Read", "api"))
+
+    assert (await storage.get_token("t:u", parse_scopes("User.Read"))).access_token == "narrow"
+    assert (await storage.get_token("t:u", parse_scopes("api://app/Read"))).access_token == "api"
+    assert await storage.get_token("t:u", parse_scopes("Mail.Read")) is None
+
+
+async def test_storage_drops_tokens_a_wider_one_covers():
+    storage = TokenStorage()
+    await storage.store_token("t:u", token("User.Read", "narrow"))
+    await storage.store_token("t:u", token("User.Read Mail.Read", "wide"))
+    assert [t.access_token for t in await storage.get_tokens("t:u")] == ["wide"]
+
+
+async def test_storage_prefers_unexpired_then_newest():
+    storage = TokenStorage()
+    await storage.store_token("t:u", token("User.Read Files.Read", "fresh", issued_at=time.time() - 60))
+    await storage.store_token("t:u", token("User.Read Mail.Read", "expired", expires_in=0))
+    assert (await storage.get_token("t:u", parse_scopes("User.Read"))).access_token == "fresh"
+    assert await storage.get_refresh_token("t:u") == "rt-expired"
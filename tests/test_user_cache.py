@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from fastauth.oauth_token_manager import AccessToken
+from fastauth.user_cache import UserCache, decode_cursor, encode_cursor
+
+TOKEN = AccessToken("at", "Bearer", 3600, "User.Read Mail.Read")
+
+
+def store(cache: UserCache, user_id: str, email: str = None):
+    cache.store_user(user_id, {"mail": email or f"{user_id.partition(':')[2]}@contoso.test"}, TOKEN)
+
+
+def test_cursor_round_trip():
+    entry = (1_700_000_000.123456789, 42, "t:u")
+    assert decode_cursor(encode_cursor(entry)) == (entry[0], entry[1])
+
+
+def test_bad_cursor():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_list_users_pages_through_everyone():
+    cache = UserCache()
+    for i in range(25):
+        store(cache, f"t{i % 2}:u{i}")
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = cache.list_users(cursor, limit=10)
+        seen += [user["id"] for user in page]
+        if cursor is None:
+            break
+    assert len(seen) == 25 and len(set(seen)) == 25
+
+
+def test_filters():
+    cache = UserCache()
+    store(cache, "t1:a", "Shared@contoso.test")
+    store(cache, "t2:b", "shared@contoso.test")
+    store(cache, "t2:c")
+
+    assert cache.count_users(tenant="t2") == 2
+    assert [u["id"] for u in cache.list_users(tenant="t1")[0]] == ["t1:a"]
+    assert cache.count_users(email="SHARED@contoso.test") == 2
+    assert [u["id"] for u in cache.list_users(email="shared@contoso.test", tenant="t2")[0]] == ["t2:b"]
+
+
+def test_refresh_keeps_one_entry():
+    cache = UserCache()
+    store(cache, "t:a")
+    store(cache, "t:a", "new@contoso.test")
+    assert len(cache) == 1
+    assert cache.count_users(tenant="t") == 1
+    assert cache.find_by_email("a@contoso.test") == []
+    assert [u["id"] for u in cache.list_users()[0]] == ["t:a"]
+
+
+def test_purge_expired():
+    cache = UserCache(ttl=10, stale_ttl=5)
+    store(cache, "t:a")
+    assert cache.lookup("t:a")[1] is False
+    assert cache.purge_expired(time.time() + 1) == 0
+    assert cache.purge_expired(time.time() + 20) == 1
+    assert len(cache) == 0
+    assert cache.count_users(tenant="t") == 0
+
+
+def test_tenant_from_user_key():
+    cache = UserCache()
+    store(cache, "contoso:alice")
+    store(cache, "alice@contoso.test")
+    assert cache.get_user("contoso:alice")["tenant_id"] == "contoso"
+    assert cache.get_user("alice@contoso.test")["tenant_id"] == "common"
+
+
+def test_last_session_ending_removes_user():
+    cache = UserCache(ttl=100, session_ttl=10)
+    seen = []
+    cache.add_listener(lambda event, user_id, tenant_id: seen.append((event, user_id)))
+    store(cache, "t:a")
+    cache.bind_session("s1", "t:a")
+    cache.bind_session("s2", "t:a")
+    cache.bind_session("s2", "t:b")  # s2 re-binds; t:a still has s1
+    assert ("remove", "t:a") not in seen
+
+    cache.purge_expired(time.time() + 20)
+    assert seen[-2:] == [("remove", "t:a"), ("remove", "t:b")]
+    assert cache.get_user("t:a") is None